@@ -1,777 +1,1161 @@
-# -*- coding: utf-8 -*-
-import ijson
-from collections import defaultdict, Counter
-from datetime import datetime
-import sys
-from urllib.parse import urlparse
-import json
-import uuid
-
-sys.stdout.reconfigure(encoding='utf-8')
-
-# Define debug_log early
-debug_file = open("debug_log.txt", "w", encoding='utf-8')
-def debug_log(message):
-    print(f"[DEBUG] {message}", file=debug_file)
-
-if len(sys.argv) < 2:
-    print("Usage: python SuperGrok.py <path_to_trace_file> [start_difference=ms] [gap_difference=ms]")
-    print("Example: python SuperGrok.py trace.json start_difference=1000 gap_difference=-200")
-    sys.exit(1)
-
-trace_file = sys.argv[1]
-start_difference = 500000  # Default 500 ms in microseconds
-gap_difference = 150000    # Default 150 ms in microseconds
-
-# Parse keyword arguments with =
-for arg in sys.argv[2:]:
-    try:
-        if arg.startswith("start_difference="):
-            start_difference = int(float(arg.split("=")[1]) * 1000)  # Convert ms to us
-            debug_log(f"Set start_difference to {start_difference} us")
-        elif arg.startswith("gap_difference="):
-            gap_difference = int(float(arg.split("=")[1]) * 1000)  # Convert ms to us
-            debug_log(f"Set gap_difference to {gap_difference} us")
-        else:
-            print(f"Warning: Ignoring unrecognized argument '{arg}'. Use start_difference=nnn or gap_difference=nnnn")
-    except (ValueError, IndexError):
-        print(f"Error: Invalid value in '{arg}'. Use like: start_difference=1000 or gap_difference=-200")
-        sys.exit(1)
-
-def parse_time(timestamp):
-    return datetime.fromtimestamp(timestamp / 1_000_000)
-
-def extract_path_from_url(url):
-    parsed_url = urlparse(url)
-    return parsed_url.path
-
-def build_span_hierarchy(spans):
-    span_dict = {}
-    hierarchy = defaultdict(list)
-    roots = []
-    for span in spans:
-        tags = span.get("tags", {})
-        operation_name = span.get("operationName", "UNKNOWN")
-        
-        if "http.request.method" in tags or "http.method" in tags:
-            method = tags.get("http.request.method") or tags.get("http.method")
-            path = tags.get("http.target") or tags.get("url.path") or tags.get("http.route") or tags.get("url.full") or None
-            if path is None and "http.url" in tags:
-                path = extract_path_from_url(tags["http.url"])
-            if path is None:
-                path = "/*"
-            operation_name = f"{method} {path}"
-        elif "db.statement" in tags:
-            db_statement = tags.get("db.statement")
-            db_table = tags.get("db.sql.table", "unknown_table")
-            if db_statement.startswith("SELECT"):
-                operation_name = f"SELECT {db_table}"
-            elif db_statement.startswith("INSERT"):
-                operation_name = f"INSERT {db_table}"
-            elif db_statement.startswith("UPDATE"):
-                operation_name = f"UPDATE {db_table}"
-            elif db_statement.startswith("DELETE"):
-                operation_name = f"DELETE {db_table}"
-            else:
-                operation_name = f"QUERY {db_table}"
-        span["operationName"] = operation_name
-        debug_log(f"Span {span['spanID']} operationName finalized: {operation_name}")
-        span_dict[span["spanID"]] = span
-
-    for span in span_dict.values():
-        parent_id = None
-        refs = span.get("references", [])
-        for ref in refs:
-            if ref["refType"] == "CHILD_OF" and ref["spanID"] in span_dict:
-                parent_id = ref["spanID"]
-                hierarchy[parent_id].append(span)
-                debug_log(f"Linked {span['spanID']} as child of {parent_id}")
-                break
-        if not parent_id:
-            roots.append(span)
-            debug_log(f"Root span {span['spanID']}")
-
-    return span_dict, hierarchy, roots
-
-def get_hierarchy_depth(span_dict, hierarchy, span_id, memo=None):
-    if memo is None:
-        memo = {}
-    if span_id in memo:
-        return memo[span_id]
-    children = hierarchy.get(span_id, [])
-    depth = 0 if not children else 1 + max((get_hierarchy_depth(span_dict, hierarchy, child["spanID"], memo) for child in children), default=0)
-    memo[span_id] = depth
-    debug_log(f"Span {span_id} depth: {depth}, children: {[child['spanID'] for child in children]}")
-    return depth
-
-def count_total_spans(span, hierarchy):
-    kids = hierarchy.get(span["spanID"], [])
-    total = 1  # Count the span itself
-    for child in kids:
-        total += count_total_spans(child, hierarchy)
-    return total
-
-def is_db_span(span):
-    return "db.statement" in span.get("tags", {})
-
-def extract_service_names(span, processes, span_dict):
-    tags = span.get("tags", {})
-    pid = span.get("processID", "")
-    process = processes.get(pid, {})
-    service_name = process.get("serviceName") or "Unknown"
-    span_kind = tags.get("span.kind", "client")
-    if span_kind == "server":
-        requesting = "Unknown"
-        receiving = service_name
-        for ref in span.get("references", []):
-            if ref["refType"] == "CHILD_OF" and ref["spanID"] in span_dict:
-                parent = span_dict[ref["spanID"]]
-                parent_pid = parent.get("processID", "")
-                parent_process = processes.get(parent_pid, {})
-                requesting = parent_process.get("serviceName") or "Unknown"
-                break
-    else:
-        requesting = service_name
-        receiving = tags.get("server.address")
-        if not receiving and "http.url" in tags:
-            parsed_url = urlparse(tags["http.url"])
-            receiving = parsed_url.hostname or "Unknown"
-        if not receiving:
-            receiving = tags.get("net.peer.name", "Unknown")
-        for server_span in span_dict.values():
-            if server_span.get("spanID") == span["spanID"]:
-                continue
-            refs = server_span.get("references", [])
-            if any(ref["spanID"] == span["spanID"] and ref["refType"] == "CHILD_OF" for ref in refs):
-                server_pid = server_span.get("processID", "")
-                server_service = processes.get(server_pid, {}).get("serviceName", receiving)
-                receiving = server_service
-                debug_log(f"Span {span['spanID']} - Overrode receiving to server span {server_span['spanID']} service: {receiving}")
-                break
-    debug_log(f"Span {span['spanID']} - Requesting: {requesting}, Receiving: {receiving}, Kind: {span_kind}, URL: {tags.get('http.url', 'N/A')}")
-    return requesting, receiving
-
-def extract_status_code(tags):
-    return tags.get("http.response.status_code", tags.get("http.status_code", "N/A"))
-
-def compare_subtrees(span1, span2, span_dict, hierarchy, processes, depth):
-    debug_log(f"Comparing spans {span1['spanID']} vs {span2['spanID']} at depth {depth}")
-    children1 = sorted(hierarchy.get(span1["spanID"], []), key=lambda x: x["operationName"])
-    children2 = sorted(hierarchy.get(span2["spanID"], []), key=lambda x: x["operationName"])
-    
-    # Check processID to ensure same requesting service
-    process_id1 = span1.get("processID", None)
-    process_id2 = span2.get("processID", None)
-    if process_id1 != process_id2:
-        service1 = processes.get(process_id1, {}).get("serviceName", "Unknown")
-        service2 = processes.get(process_id2, {}).get("serviceName", "Unknown")
-        debug_log(f"Span {span1['spanID']} (service: {service1}) vs {span2['spanID']} (service: {service2}) - processID mismatch")
-        return False
-    
-    def get_max_depth(span_id, current_depth=0):
-        kids = hierarchy.get(span_id, [])
-        if not kids:
-            return current_depth
-        return max(get_max_depth(k["spanID"], current_depth + 1) for k in kids)
-    
-    depth1 = get_max_depth(span1["spanID"])
-    depth2 = get_max_depth(span2["spanID"])
-    debug_log(f"Depth check: {span1['spanID']} depth {depth1}, {span2['spanID']} depth {depth2}")
-    if depth == 0 and (depth1 < 2 or depth2 < 2 or depth1 != depth2):
-        debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - root depth mismatch or < 2: {depth1} vs {depth2}")
-        return False
-    
-    span_count1 = count_total_spans(span1, hierarchy)
-    span_count2 = count_total_spans(span2, hierarchy)
-    debug_log(f"Span count: {span1['spanID']} has {span_count1}, {span2['spanID']} has {span_count2}")
-    if span_count1 != span_count2:
-        debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - total span count mismatch: {span_count1} vs {span_count2}")
-        return False
-    
-    if depth == 0:
-        time_diff = abs(span1["startTime"] - span2["startTime"])
-        debug_log(f"Time diff: {time_diff}us")
-        if time_diff > start_difference:
-            debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - start time diff > {start_difference}us: {time_diff}us")
-            return False
-        end1 = span1["startTime"] + span1["duration"]
-        end2 = span2["startTime"] + span2["duration"]
-        if end1 < span2["startTime"]:
-            gap = span2["startTime"] - end1
-            debug_log(f"Gap check: {span1['spanID']} ends {end1}, {span2['spanID']} starts {span2['startTime']}, gap {gap}us")
-            if gap_difference >= 0 and gap > gap_difference:
-                debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - gap > {gap_difference}us: {gap}us")
-                return False
-        elif end2 < span1["startTime"]:
-            gap = span1["startTime"] - end2
-            debug_log(f"Gap check: {span2['spanID']} ends {end2}, {span1['spanID']} starts {span1['startTime']}, gap {gap}us")
-            if gap_difference >= 0 and gap > gap_difference:
-                debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - gap > {gap_difference}us: {gap}us")
-                return False
-        if gap_difference < 0:  # Strict overlap
-            overlap = min(end1, end2) - max(span1["startTime"], span2["startTime"])
-            min_overlap = -gap_difference
-            debug_log(f"Overlap check: {span1['spanID']} vs {span2['spanID']}, overlap {overlap}us, min required {min_overlap}us")
-            if overlap < min_overlap:
-                debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - overlap < {min_overlap}us: {overlap}us")
-                return False
-        duration_diff = abs(span1["duration"] - span2["duration"])
-        max_duration = max(span1["duration"], span2["duration"])
-        debug_log(f"Duration diff: {duration_diff}us, max: {max_duration}us, 20% threshold: {0.2 * max_duration}us")
-        if span1["duration"] < 20000 and span2["duration"] < 20000:
-            if duration_diff > 100000:
-                debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - short span duration diff > 100ms: {duration_diff}us")
-                return False
-            debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - short span duration diff OK: {duration_diff}us")
-        elif span1["duration"] >= 20000 or span2["duration"] >= 20000:
-            if duration_diff > 100000:
-                debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - duration diff > 100ms: {duration_diff}us")
-                return False
-            if duration_diff > 0.2 * max_duration:
-                debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - duration diff > 20% of max: {duration_diff}us vs {0.2 * max_duration}us")
-                return False
-            debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - duration diff OK: {duration_diff}us vs max {max_duration}us")
-    
-    if span1["operationName"] != span2["operationName"]:
-        if not (is_db_span(span1) and is_db_span(span2) and span1["operationName"].startswith("QUERY") and span2["operationName"].startswith("QUERY")):
-            debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - operationName mismatch: {span1['operationName']} vs {span2['operationName']}")
-            return False
-        debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - DB QUERY operations treated as equivalent")
-    
-    debug_log(f"Span {span1['spanID']} children: {[c['spanID'] + ' ' + c['operationName'] for c in children1]}")
-    debug_log(f"Span {span2['spanID']} children: {[c['spanID'] + ' ' + c['operationName'] for c in children2]}")
-    
-    if not children1 and not children2:
-        debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - leaf nodes match")
-        return True
-    
-    if len(children1) != len(children2):
-        debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - child count mismatch: {len(children1)} vs {len(children2)}")
-        return False
-    
-    if any(is_db_span(c) for c in children1):
-        query_count1 = sum(1 for c in children1 if is_db_span(c))
-        query_count2 = sum(1 for c in children2 if is_db_span(c))
-        debug_log(f"Query count: {span1['spanID']} has {query_count1}, {span2['spanID']} has {query_count2}")
-        if query_count1 != query_count2:
-            debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - DB query count mismatch: {query_count1} vs {query_count2}")
-            return False
-        debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - DB query counts match: {query_count1}")
-    else:
-        for c1, c2 in zip(children1, children2):
-            if not compare_subtrees(c1, c2, span_dict, hierarchy, processes, depth + 1):
-                debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - child comparison failed at depth {depth + 1}")
-                return False
-    
-    debug_log(f"Span {span1['spanID']} vs {span2['spanID']} - subtrees match fully")
-    return True
-    
-def cluster_parallel_subtrees(spans, span_dict, hierarchy, processes, parent_id, depth):
-    debug_log(f"Clustering spans for parent {parent_id} at depth {depth}: {[s['spanID'] + ' ' + s['operationName'] for s in spans]}")
-    spans = sorted(spans, key=lambda x: x["startTime"])
-    
-    clusters = []
-    remaining = spans[:]
-    while remaining:
-        root = remaining.pop(0)
-        debug_log(f"Processing root span {root['spanID']} - {root['operationName']}")
-        if is_db_span(root):
-            debug_log(f"Skipping span {root['spanID']} - root is a DB query")
-            continue
-        cluster = [(root, count_total_spans(root, hierarchy))]
-        i = 0
-        while i < len(remaining):
-            candidate = remaining[i]
-            debug_log(f"Comparing root {root['spanID']} (start: {root['startTime']}, dur: {root['duration']}) vs candidate {candidate['spanID']} (start: {candidate['startTime']}, dur: {candidate['duration']})")
-            if compare_subtrees(root, candidate, span_dict, hierarchy, processes, 0):
-                cluster.append((remaining.pop(i), count_total_spans(candidate, hierarchy)))
-                debug_log(f"Added {candidate['spanID']} to cluster with root {root['spanID']}")
-            else:
-                debug_log(f"No match between {root['spanID']} and {candidate['spanID']} - failed criteria")
-                i += 1
-        debug_log(f"Finished clustering attempt with root {root['spanID']}, cluster size: {len(cluster)}")
-        if len(cluster) >= 2:
-            clusters.append(cluster)
-            debug_log(f"Cluster formed for parent {parent_id} at depth {depth}: {[s[0]['spanID'] for s in cluster]}")
-        else:
-            debug_log(f"Span {root['spanID']} not clustered - no matches found")
-    
-    debug_log(f"Clustering complete for parent {parent_id} at depth {depth} - {len(clusters)} clusters formed")
-    return clusters
-
-def find_duplicate_spans(file_path):
-    try:
-        with open(file_path, "r", encoding='utf-8') as file:
-            parser = ijson.parse(file)
-            spans = []
-            processes = {}
-            trace_id = None
-            current_span = None
-            current_span_tags = []
-            current_references = []
-
-            debug_log("Starting parsing with UTF-8")
-
-            for prefix, event, value in parser:
-                parts = prefix.split(".")
-                if prefix == "data.item.traceID" and event == "string":
-                    trace_id = value
-                    debug_log(f"Trace ID: {trace_id}")
-
-                elif prefix == "data.item.spans.item" and event == "start_map":
-                    current_span = {"tags": {}, "references": []}
-                    current_span_tags = []
-                    current_references = []
-
-                elif prefix == "data.item.spans.item" and event == "end_map":
-                    if current_span:
-                        current_span["tags"] = {tag["key"]: tag["value"] for tag in current_span_tags if "key" in tag and "value" in tag}
-                        current_span["references"] = current_references
-                        if "spanID" in current_span and "startTime" in current_span and "duration" in current_span:
-                            spans.append(current_span)
-                            debug_log(f"Span added: {current_span['spanID']}")
-                        current_span = None
-
-                elif prefix == "data.item.spans.item.tags.item" and event == "start_map":
-                    current_span_tags.append({})
-                elif prefix.endswith(".key") and event in ("string", "number") and current_span_tags:
-                    current_span_tags[-1]["key"] = str(value).replace("http.method", "http.request.method")
-                elif prefix.endswith(".value") and event in ("string", "number") and current_span_tags:
-                    current_span_tags[-1]["value"] = str(value)
-
-                elif prefix == "data.item.spans.item.references.item" and event == "start_map":
-                    current_references.append({})
-                elif prefix.endswith(".refType") and current_references:
-                    current_references[-1]["refType"] = value
-                elif prefix.endswith(".spanID") and event == "string":
-                    if current_references:
-                        current_references[-1]["spanID"] = value
-                    elif prefix == "data.item.spans.item.spanID":
-                        current_span["spanID"] = value
-
-                elif current_span and event in ("string", "number"):
-                    if prefix == "data.item.spans.item.operationName":
-                        current_span["operationName"] = value
-                    elif prefix == "data.item.spans.item.startTime":
-                        current_span["startTime"] = int(value)
-                    elif prefix == "data.item.spans.item.duration":
-                        current_span["duration"] = int(value)
-                    elif prefix == "data.item.spans.item.processID":
-                        current_span["processID"] = value
-
-                elif prefix.startswith("data.item.processes"):
-                    if len(parts) >= 4:
-                        pid = parts[3]
-                        if pid.startswith("p") and pid[1:].isdigit():
-                            if event == "string" and prefix.endswith(".serviceName"):
-                                if pid not in processes:
-                                    processes[pid] = {}
-                                processes[pid]["serviceName"] = value
-
-    except UnicodeDecodeError:
-        debug_log("UTF-8 decoding failed, falling back to Latin-1")
-        with open(file_path, "r", encoding='latin-1') as file:
-            parser = ijson.parse(file)
-            spans = []
-            processes = {}
-            trace_id = None
-            current_span = None
-            current_span_tags = []
-            current_references = []
-
-            debug_log("Starting parsing with Latin-1")
-
-            for prefix, event, value in parser:
-                parts = prefix.split(".")
-                if prefix == "data.item.traceID" and event == "string":
-                    trace_id = value
-                    debug_log(f"Trace ID: {trace_id}")
-
-                elif prefix == "data.item.spans.item" and event == "start_map":
-                    current_span = {"tags": {}, "references": []}
-                    current_span_tags = []
-                    current_references = []
-
-                elif prefix == "data.item.spans.item" and event == "end_map":
-                    if current_span:
-                        current_span["tags"] = {tag["key"]: tag["value"] for tag in current_span_tags if "key" in tag and "value" in tag}
-                        current_span["references"] = current_references
-                        if "spanID" in current_span and "startTime" in current_span and "duration" in current_span:
-                            spans.append(current_span)
-                            debug_log(f"Span added: {current_span['spanID']}")
-                        current_span = None
-
-                elif prefix == "data.item.spans.item.tags.item" and event == "start_map":
-                    current_span_tags.append({})
-                elif prefix.endswith(".key") and event in ("string", "number") and current_span_tags:
-                    current_span_tags[-1]["key"] = str(value).replace("http.method", "http.request.method")
-                elif prefix.endswith(".value") and event in ("string", "number") and current_span_tags:
-                    current_span_tags[-1]["value"] = str(value)
-
-                elif prefix == "data.item.spans.item.references.item" and event == "start_map":
-                    current_references.append({})
-                elif prefix.endswith(".refType") and current_references:
-                    current_references[-1]["refType"] = value
-                elif prefix.endswith(".spanID") and event == "string":
-                    if current_references:
-                        current_references[-1]["spanID"] = value
-                    elif prefix == "data.item.spans.item.spanID":
-                        current_span["spanID"] = value
-
-                elif current_span and event in ("string", "number"):
-                    if prefix == "data.item.spans.item.operationName":
-                        current_span["operationName"] = value
-                    elif prefix == "data.item.spans.item.startTime":
-                        current_span["startTime"] = int(value)
-                    elif prefix == "data.item.spans.item.duration":
-                        current_span["duration"] = int(value)
-                    elif prefix == "data.item.spans.item.processID":
-                        current_span["processID"] = value
-
-                elif prefix.startswith("data.item.processes"):
-                    if len(parts) >= 4:
-                        pid = parts[3]
-                        if pid.startswith("p") and pid[1:].isdigit():
-                            if event == "string" and prefix.endswith(".serviceName"):
-                                if pid not in processes:
-                                    processes[pid] = {}
-                                processes[pid]["serviceName"] = value
-
-    if not spans or not trace_id:
-        debug_log(f"Spans: {len(spans)}, Trace ID: {trace_id}")
-        print("No valid spans or trace ID found.")
-        sys.exit(1)
-
-    span_dict, hierarchy, roots = build_span_hierarchy(spans)
-    depth_map = {span_id: get_hierarchy_depth(span_dict, hierarchy, span_id) for span_id in span_dict}
-
-    parent_groups = defaultdict(list)
-    for span in span_dict.values():
-        depth = depth_map[span["spanID"]]
-        debug_log(f"Span {span['spanID']} has depth {depth}")
-        if depth < 1:
-            debug_log(f"Skipping span {span['spanID']} - depth {depth} < 1")
-            continue
-        parent_id = None
-        for ref in span.get("references", []):
-            if ref["refType"] == "CHILD_OF" and ref["spanID"] in span_dict:
-                parent_id = ref["spanID"]
-                break
-        if parent_id:
-            parent_groups[parent_id].append(span)
-            debug_log(f"Span {span['spanID']} grouped under parent {parent_id}: {span['operationName']}")
-
-    duplicate_groups = {}
-    for parent_id, group in parent_groups.items():
-        debug_log(f"Group for parent {parent_id}: {[s['spanID'] + ' ' + s['operationName'] for s in group]}")
-        if len(group) > 1:
-            debug_log(f"Processing group for parent {parent_id} with {len(group)} spans")
-            clusters = cluster_parallel_subtrees(group, span_dict, hierarchy, processes, parent_id, 0)
-            if clusters:
-                duplicate_groups[parent_id] = clusters
-            else:
-                debug_log(f"No clusters formed for parent {parent_id}")
-        else:
-            debug_log(f"Skipping clustering for parent {parent_id} - no duplicates (size: {len(group)})")
-
-    debug_log(f"Final processes dict: {processes}")
-    debug_log(f"Depth map: {depth_map}")
-    return duplicate_groups, trace_id, processes, span_dict, hierarchy
-
-def summarize_duplicates(duplicate_groups, trace_id, processes, span_dict, hierarchy):
-    lines = [f"\nRelated Subtrees in Trace ID: {trace_id}\n"]
-    if not duplicate_groups:
-        lines.append("No matching parallel subtrees found.")
-        return "\n".join(lines), {}
-
-    def get_leaf_operations_with_depth(span, hierarchy, current_depth=0):
-        kids = hierarchy.get(span["spanID"], [])
-        leaf_ops = []
-        if not kids:
-            tags = span.get("tags", {})
-            pid = span.get("processID", "")
-            service = processes.get(pid, {}).get("serviceName", "Unknown")
-            db_sample = None
-            op = span.get("operationName", "UNKNOWN")
-            debug_log(f"Processing span {span['spanID']}, original op: {op}")
-            if "db.statement" in tags:
-                db_operation = tags.get("db.operation", None)
-                raw_statement = tags.get("db.statement", "").strip().upper()
-                if db_operation:
-                    op = f"{service} DB QUERY {db_operation}"
-                    if raw_statement:
-                        if db_operation.upper() not in raw_statement.split()[0]:
-                            debug_log(f"Span {span['spanID']} - db.operation '{db_operation}' does not match db.statement '{raw_statement}'")
-                            db_sample = f"MISMATCH (Expected {db_operation})"
-                        else:
-                            db_sample = (raw_statement[:50] + "...") if len(raw_statement) > 50 else raw_statement
-                    else:
-                        db_sample = "NO STATEMENT"
-                else:
-                    # Smarter detection: Look for SQL keywords in the statement
-                    stmt_words = raw_statement.split()
-                    if "SELECT" in stmt_words:
-                        op = f"{service} DB QUERY SELECT"
-                    elif "INSERT" in stmt_words:
-                        op = f"{service} DB QUERY INSERT"
-                    elif "UPDATE" in stmt_words:
-                        op = f"{service} DB QUERY UPDATE"
-                    elif "DELETE" in stmt_words:
-                        op = f"{service} DB QUERY DELETE"
-                    else:
-                        op = f"{service} DB QUERY"
-                    db_sample = (raw_statement[:50] + "...") if len(raw_statement) > 50 else raw_statement or "NO STATEMENT"
-            elif "http.method" in tags:
-                op = f"{service} HTTP {tags['http.method']}"
-            else:
-                if "ack" in op.lower() and "-" in op:
-                    op = f"{service} ack"
-                else:
-                    op = f"{service} {op}"
-            debug_log(f"Leaf span {span['spanID']}: {op}, sample: {db_sample}")
-            leaf_ops.append((op, current_depth, db_sample, span["spanID"]))
-        for child in kids:
-            leaf_ops.extend(get_leaf_operations_with_depth(child, hierarchy, current_depth + 1))
-        return leaf_ops
-
-    grouped_clusters = defaultdict(list)
-    for parent_id, clusters in sorted(duplicate_groups.items()):
-        for cluster in clusters:
-            operation = cluster[0][0]["operationName"]
-            grouped_clusters[(parent_id, operation)].append(cluster)
-
-    cluster_leaf_ops = {}
-    for (parent_id, operation), clusters in sorted(grouped_clusters.items()):
-        span = span_dict.get(parent_id, {})
-        parent_op = span.get("operationName", "Unknown")
-        parent_service, _ = extract_service_names(span, processes, span_dict)
-        if span.get("tags", {}).get("span.kind") == "server":
-            parent_service = processes.get(span.get("processID", ""), {}).get("serviceName", "Unknown")
-        
-        lines.append(f"Parent: {parent_service} - {parent_op} (Span ID: {parent_id})")
-        lines.append(f"Operation: {operation}")
-        
-        for cluster_idx, cluster in enumerate(clusters[:10]):
-            req, rec = extract_service_names(cluster[0][0], processes, span_dict)
-            depth = get_hierarchy_depth(span_dict, hierarchy, cluster[0][0]["spanID"])
-            total_spans = sum(count for _, count in cluster)
-            lines.append(f"- Requesting: {req}, Receiving: {rec} (Size: {len(cluster)}, Depth: {depth}, Spans: {total_spans}):")
-            for j, (span, _) in enumerate(cluster[:5], 1):
-                start_time = parse_time(span["startTime"])
-                duration = span["duration"]
-                status_code = extract_status_code(span["tags"])
-                lines.append(f"  Subtree Root {j} - ID: {span['spanID']}, Start: {start_time}, Duration: {duration}us, Status: {status_code}")
-            if len(cluster) > 5:
-                lines.append(f"    ...and {len(cluster) - 5} more subtrees")
-            
-            leaf_ops_with_depth = get_leaf_operations_with_depth(cluster[0][0], hierarchy)
-            total_leaves = len(leaf_ops_with_depth)
-            debug_log(f"Cluster {operation} under parent {parent_id}: Total leaves = {total_leaves}")
-            depth_ops = defaultdict(list)
-            for op, d, sample, span_id in leaf_ops_with_depth:
-                depth_ops[d].append((op, sample, span_id))
-            lines.append(f"  Leaf Operations by Depth: Total {total_leaves}")
-            for d in sorted(depth_ops.keys()):
-                op_counts = Counter(op for op, _, _ in depth_ops[d])
-                lines.append(f"    Depth {d}:")
-                for op, count in op_counts.items():
-                    sample = next(s for o, s, _ in depth_ops[d] if o == op)
-                    if "DB QUERY" in op and sample:
-                        lines.append(f"      {count:<2} {op} (e.g., {sample})")
-                    else:
-                        lines.append(f"      {count:<2} {op}")
-            lines.append("")
-
-            cluster_key = f"{parent_id}:{operation}"
-            all_leaf_ops = []
-            for subtree_idx, (root_span, _) in enumerate(cluster):
-                subtree_leaves = get_leaf_operations_with_depth(root_span, hierarchy)
-                all_leaf_ops.extend(subtree_leaves)
-                debug_log(f"Collected {len(subtree_leaves)} leaf ops from subtree {subtree_idx} in cluster {cluster_key}")
-
-            depth_ops_all = defaultdict(list)
-            for op, d, sample, span_id in all_leaf_ops:
-                depth_ops_all[d].append((op, sample, span_id))
-            cluster_leaf_ops[cluster_key] = {
-                "total_leaves": total_leaves,
-                "by_depth": {
-                    str(d): [{"operation": op, "count": count, "sample": next(s for o, s, _ in depth_ops_all[d] if o == op), "span_ids": [sid for o, _, sid in depth_ops_all[d] if o == op]}
-                             for op, count in Counter(op for op, _, _ in depth_ops_all[d]).items()]
-                    for d in sorted(depth_ops_all.keys())
-                }
-            }
-        lines.append("-" * 40)
-
-    return "\n".join(lines), cluster_leaf_ops
-
-def get_subtree_spans(root_span, hierarchy, span_dict):
-    """Collect all spans in the subtree rooted at root_span, preserving hierarchy."""
-    spans = [root_span]
-    children = hierarchy.get(root_span["spanID"], [])
-    for child in children:
-        spans.extend(get_subtree_spans(child, hierarchy, span_dict))
-    return spans
-
-def convert_tags_to_jaeger_format(tags_dict):
-    """Convert a dictionary of tags to Jaeger's expected list of tag objects."""
-    tag_list = []
-    for key, value in tags_dict.items():
-        tag_type = "string"
-        if isinstance(value, int):
-            tag_type = "int64"
-        elif isinstance(value, float):
-            tag_type = "float64"
-        elif isinstance(value, bool):
-            tag_type = "bool"
-        tag_list.append({
-            "key": key,
-            "type": tag_type,
-            "value": value
-        })
-    return tag_list
-
-def export_clustered_traces_json(duplicate_groups, trace_id, processes, span_dict, hierarchy, cluster_leaf_ops, output_file="clustered_traces.json"):
-    """Export each cluster of matching subtrees as a single trace in Jaeger-compatible JSON format, preserving original spanIDs and parent operation."""
-    if not duplicate_groups:
-        debug_log("No duplicate groups found to export.")
-        return
-
-    output_data = []
-    grouped_clusters = defaultdict(list)
-    for parent_id, clusters in duplicate_groups.items():
-        for cluster in clusters:
-            operation = cluster[0][0]["operationName"]
-            grouped_clusters[(parent_id, operation)].append(cluster)
-
-    for (parent_id, operation), clusters in sorted(grouped_clusters.items()):
-        cluster_key = f"{parent_id}:{operation}"
-        leaf_ops_data = cluster_leaf_ops.get(cluster_key, {})
-        span_op_map = {}
-        for depth, ops in leaf_ops_data.get("by_depth", {}).items():
-            for op_data in ops:
-                operation_name = op_data["operation"]
-                sample = op_data["sample"]
-                for span_id in op_data["span_ids"]:
-                    span_op_map[span_id] = {"operation": operation_name, "sample": sample}
-
-        for cluster_idx, cluster in enumerate(clusters):
-            total_subtree_spans = sum(count for _, count in cluster)
-            cluster_size = len(cluster)
-            spans_per_subtree = total_subtree_spans // cluster_size
-            debug_log(f"Cluster {cluster_idx + 1} under parent {parent_id}, operation {operation} has size: {cluster_size}, total subtree spans: {total_subtree_spans}, spans per subtree: {spans_per_subtree}")
-
-            new_trace_id = str(uuid.uuid4()).replace("-", "")
-            parent_span = span_dict.get(parent_id)
-            if not parent_span:
-                debug_log(f"Warning: Parent span {parent_id} not found in span_dict for cluster {cluster_idx + 1}")
-                continue
-
-            first_subtree_root = cluster[0][0]
-            requesting_service = processes.get(first_subtree_root.get("processID", ""), {}).get("serviceName", "Unknown")
-            subtree_operation = first_subtree_root["operationName"]
-
-            all_spans = [parent_span]
-            involved_processes = set([parent_span.get("processID")]) if parent_span.get("processID") else set()
-            seen_span_ids = {parent_span["spanID"]}
-
-            for subtree_idx, (root_span, _) in enumerate(cluster):
-                subtree_spans = get_subtree_spans(root_span, hierarchy, span_dict)
-                debug_log(f"Subtree {subtree_idx + 1} in cluster {cluster_idx + 1} has {len(subtree_spans)} spans")
-                for span in subtree_spans:
-                    if span["spanID"] not in seen_span_ids:
-                        all_spans.append(span)
-                        seen_span_ids.add(span["spanID"])
-
-            new_spans = []
-            total_spans_excluding_parent = len(all_spans) - 1
-            total_spans_in_trace = len(all_spans)
-            debug_log(f"Total spans in trace (including parent): {total_spans_in_trace}, reported spans (excluding parent): {total_spans_excluding_parent}")
-
-            for span_idx, span in enumerate(all_spans):
-                new_span = span.copy()
-                new_span["traceID"] = new_trace_id
-                new_span["spanID"] = span["spanID"]
-
-                if span["spanID"] in span_op_map:
-                    original_op = new_span["operationName"]
-                    new_span["operationName"] = span_op_map[span["spanID"]]["operation"]
-                    debug_log(f"Updated span {span['spanID']} from {original_op} to {new_span['operationName']}")
-
-                new_references = []
-                for ref in new_span.get("references", []):
-                    new_ref = ref.copy()
-                    new_ref["traceID"] = new_trace_id
-                    new_ref["spanID"] = ref["spanID"]
-                    new_references.append(new_ref)
-                new_span["references"] = new_references
-
-                if "tags" in new_span:
-                    new_span["tags"] = convert_tags_to_jaeger_format(new_span["tags"])
-                else:
-                    new_span["tags"] = []
-
-                if "logs" not in new_span:
-                    new_span["logs"] = []
-                if "warnings" not in new_span:
-                    new_span["warnings"] = None
-
-                if span_idx == 0:  # Parent span
-                    original_operation = new_span["operationName"]  # Keep as is
-                    new_span["tags"].extend([
-                        {"key": "original.operationName", "type": "string", "value": original_operation},
-                        {"key": "clustered.operationName", "type": "string", "value": subtree_operation},  # Add subtree operation as a tag
-                        {"key": "cluster.group", "type": "string", "value": f"{parent_id}:{operation}"},
-                        {"key": "cluster.size", "type": "int64", "value": cluster_size},
-                        {"key": "cluster.total_subtree_spans", "type": "int64", "value": total_subtree_spans},
-                        {"key": "spans.per.subtree", "type": "int64", "value": spans_per_subtree},
-                        {"key": "reported.spans.in.trace", "type": "int64", "value": total_spans_excluding_parent},
-                        {"key": "actual.spans.in.trace", "type": "int64", "value": total_spans_in_trace}
-                    ])
-                else:
-                    subtree_idx = (span_idx - 1) // spans_per_subtree
-                    new_span["tags"].append({"key": "subtree.index", "type": "int64", "value": subtree_idx})
-                    new_span["tags"].append({"key": "cluster.group", "type": "string", "value": f"{parent_id}:{operation}"})
-                    if span["spanID"] in span_op_map and span_op_map[span["spanID"]]["sample"]:
-                        new_span["tags"].append({
-                            "key": "db.statement.sample",
-                            "type": "string",
-                            "value": span_op_map[span["spanID"]]["sample"]
-                        })
-
-                if "processID" in new_span:
-                    involved_processes.add(new_span["processID"])
-
-                new_spans.append(new_span)
-
-            trace_processes = {pid: processes[pid] for pid in involved_processes if pid in processes}
-            output_data.append({
-                "traceID": new_trace_id,
-                "spans": new_spans,
-                "processes": trace_processes
-            })
-            debug_log(f"Exported trace {new_trace_id} for cluster {cluster_idx + 1} under parent {parent_id}, operation {operation}, total spans in this trace: {len(new_spans)}, reported spans: {total_spans_excluding_parent}")
-
-    output_json = {"data": output_data}
-    try:
-        with open(output_file, "w", encoding='utf-8') as f:
-            json.dump(output_json, f, indent=4)
-        debug_log(f"Successfully wrote {len(output_data)} clustered traces to {output_file}")
-        print(f"Clustered traces exported to {output_file} with {len(output_data)} traces")
-        print("Note: Each trace includes the parent span and all matching subtrees. The 'reported.spans.in.trace' tag excludes the parent to match log.txt, while Jaeger UI shows all spans including the parent.")
-    except Exception as e:
-        debug_log(f"Error writing JSON output: {str(e)}")
-        print(f"Error writing JSON output: {e}", file=sys.stderr)
-        
-if __name__ == "__main__":
-    try:
-        duplicate_groups, trace_id, processes, span_dict, hierarchy = find_duplicate_spans(trace_file)
-        log_output, cluster_leaf_ops = summarize_duplicates(duplicate_groups, trace_id, processes, span_dict, hierarchy)
-        print(log_output)
-        # Add the export of clustered traces with leaf operations
-        export_clustered_traces_json(duplicate_groups, trace_id, processes, span_dict, hierarchy, cluster_leaf_ops)
-    except Exception as e:
-        debug_log(f"Error: {str(e)}")
-        print(f"Error: {e}", file=sys.stderr)
-        sys.exit(1)
-    finally:
-        debug_file.close()
+# -*- coding: utf-8 -*-
+try:
+    import ijson.backends.yajl2_c as ijson
+except ImportError:
+    try:
+        import ijson.backends.yajl2_cffi as ijson
+    except ImportError:
+        import ijson
+import orjson
+import numpy as np
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+import os
+import sys
+import uuid
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+# Define debug_log early. Logging is off by default - the hot paths call it
+# constantly, so the disabled variant must be a plain no-op with no file I/O.
+# Enable with SPANS_DEBUG=1.
+DEBUG = os.environ.get("SPANS_DEBUG") == "1"
+if DEBUG:
+    # 1MB buffer - debug runs write a line per span/comparison, and flushing
+    # each would be a syscall per message. Closed at exit.
+    debug_file = open("debug_log.txt", "w", encoding='utf-8', buffering=1 << 20)
+    def debug_log(message):
+        print(f"[DEBUG] {message}", file=debug_file)
+else:
+    debug_file = None
+    def debug_log(message):
+        pass
+
+if len(sys.argv) < 2:
+    print("Usage: python SuperGrok.py <path_to_trace_file> [start_difference=ms] [gap_difference=ms]")
+    print("Example: python SuperGrok.py trace.json start_difference=1000 gap_difference=-200")
+    sys.exit(1)
+
+trace_file = sys.argv[1]
+start_difference = 500000  # Default 500 ms in microseconds
+gap_difference = 150000    # Default 150 ms in microseconds
+STREAMING_THRESHOLD = 500 * 1024 * 1024  # Above this size, stream with ijson instead of loading in one piece
+
+# Parse keyword arguments with =
+for arg in sys.argv[2:]:
+    try:
+        if arg.startswith("start_difference="):
+            start_difference = int(float(arg.split("=")[1]) * 1000)  # Convert ms to us
+            debug_log(f"Set start_difference to {start_difference} us")
+        elif arg.startswith("gap_difference="):
+            gap_difference = int(float(arg.split("=")[1]) * 1000)  # Convert ms to us
+            debug_log(f"Set gap_difference to {gap_difference} us")
+        else:
+            print(f"Warning: Ignoring unrecognized argument '{arg}'. Use start_difference=nnn or gap_difference=nnnn")
+    except (ValueError, IndexError):
+        print(f"Error: Invalid value in '{arg}'. Use like: start_difference=1000 or gap_difference=-200")
+        sys.exit(1)
+
+# Tag keys and operation names repeat across thousands of spans; interning
+# collapses them to shared singletons so dict lookups and equality checks hit
+# CPython's pointer fast path instead of hashing/comparing full strings.
+_intern = sys.intern
+
+@dataclass(slots=True)
+class Span:
+    """One trace span in the internal layout.
+
+    Slots keep 50k+ span objects to a fixed-size attribute array instead of a
+    per-span dict, and turn every field access in the hot comparison loops
+    into an offset load rather than a hash lookup."""
+    spanID: str
+    startTime: int
+    duration: int
+    processID: str
+    operationName: str
+    tags: dict
+    references: tuple  # of (refType, spanID) pairs
+    isDb: bool = False
+    opIsQuery: bool = False
+    httpMethod: str | None = None
+    httpPath: str | None = None
+    dbStatement: str | None = None
+    dbTable: str = "unknown_table"
+    sig: int = 0
+    dbFree: bool = True
+    subtreeSize: int = 1
+    childService: str | None = None
+    startDisplay: str = ""
+    leafOp: str = ""
+    dbSample: str | None = None
+    sortedChildren: tuple = ()
+    childOpsKey: tuple = ()
+
+# SQL verbs that keep their own label in the operation name; anything else
+# collapses to QUERY.
+_DB_VERBS = {"SELECT": "SELECT", "INSERT": "INSERT", "UPDATE": "UPDATE", "DELETE": "DELETE"}
+
+def parse_time(timestamp):
+    return datetime.fromtimestamp(timestamp / 1_000_000)
+
+@lru_cache(maxsize=4096)
+def _parse_url(url):
+    """Hostname and path of a URL, memoized - a trace repeats the same handful
+    of URLs across thousands of spans, so most calls become cache hits.
+
+    Hand-rolled scan instead of urlparse: trace URLs are plain
+    scheme://host[:port]/path[?query] strings, and urlparse builds a full
+    ParseResult with quoting/encoding handling just to read two fields."""
+    i = url.find("://")
+    if i < 0:
+        # No netloc (e.g. a bare "/api/foo" path): the whole string up to any
+        # query/fragment is the path, matching urlparse's behaviour.
+        path = url
+        for sep in ("?", "#"):
+            j = path.find(sep)
+            if j >= 0:
+                path = path[:j]
+        return None, path
+    netloc_start = i + 3
+    end = len(url)
+    for sep in ("/", "?", "#"):
+        j = url.find(sep, netloc_start)
+        if 0 <= j < end:
+            end = j
+    netloc = url[netloc_start:end]
+    if end < len(url) and url[end] == "/":
+        path = url[end:]
+        for sep in ("?", "#"):
+            j = path.find(sep)
+            if j >= 0:
+                path = path[:j]
+    else:
+        path = ""
+    # Hostname the way urlparse reports it: userinfo and port stripped,
+    # IPv6 brackets removed, lowercased, None when empty.
+    at = netloc.rfind("@")
+    if at >= 0:
+        netloc = netloc[at + 1:]
+    if netloc.startswith("["):
+        close = netloc.find("]")
+        host = netloc[1:close] if close >= 0 else netloc[1:]
+    else:
+        host = netloc.partition(":")[0]
+    return (host.lower() or None), path
+
+def extract_path_from_url(url):
+    return _parse_url(url)[1]
+
+def _leaf_label(span, processes):
+    """Display label and DB statement sample for a leaf span.
+
+    Pure function of the span's own tags and process, so it is computed once
+    per leaf in build_span_hierarchy instead of on every subtree walk in
+    summarize_duplicates."""
+    tags = span.tags
+    service = processes.get(span.processID, {}).get("serviceName", "Unknown")
+    db_sample = None
+    op = span.operationName
+    if "db.statement" in tags:
+        db_operation = tags.get("db.operation", None)
+        raw_statement = tags.get("db.statement", "").strip().upper()
+        if db_operation:
+            op = f"{service} DB QUERY {db_operation}"
+            if raw_statement:
+                if db_operation.upper() not in raw_statement.split()[0]:
+                    if DEBUG:
+                        debug_log(f"Span {span.spanID} - db.operation '{db_operation}' does not match db.statement '{raw_statement}'")
+                    db_sample = f"MISMATCH (Expected {db_operation})"
+                else:
+                    db_sample = (raw_statement[:50] + "...") if len(raw_statement) > 50 else raw_statement
+            else:
+                db_sample = "NO STATEMENT"
+        else:
+            # Smarter detection: look for SQL keywords in the statement. One
+            # set build replaces up to four linear scans of the token list;
+            # the tuple keeps the original SELECT-first priority.
+            stmt_tokens = set(raw_statement.split())
+            for verb in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+                if verb in stmt_tokens:
+                    op = f"{service} DB QUERY {verb}"
+                    break
+            else:
+                op = f"{service} DB QUERY"
+            db_sample = (raw_statement[:50] + "...") if len(raw_statement) > 50 else raw_statement or "NO STATEMENT"
+    elif "http.method" in tags:
+        op = f"{service} HTTP {tags['http.method']}"
+    else:
+        if "ack" in op.lower() and "-" in op:
+            op = f"{service} ack"
+        else:
+            op = f"{service} {op}"
+    if DEBUG:
+        debug_log(f"Leaf span {span.spanID}: {op}, sample: {db_sample}")
+    return op, db_sample
+
+def build_span_hierarchy(spans, processes):
+    span_dict = {}
+    hierarchy = defaultdict(list)
+    roots = []
+    for span in spans:
+        operation_name = span.operationName
+
+        if span.httpMethod is not None:
+            path = span.httpPath
+            if path is None:
+                path = "/*"
+            operation_name = f"{span.httpMethod} {path}"
+        elif span.isDb:
+            # One token scan plus a dict lookup instead of a four-way
+            # startswith cascade over the statement prefix.
+            verb = span.dbStatement.partition(" ")[0]
+            operation_name = f"{_DB_VERBS.get(verb, 'QUERY')} {span.dbTable}"
+        span.operationName = _intern(operation_name)
+        span.opIsQuery = span.isDb and operation_name.startswith("QUERY")
+        # Render the wall-clock start once; the summary would otherwise build
+        # a datetime object per printed line.
+        span.startDisplay = str(parse_time(span.startTime))
+        if DEBUG:
+            debug_log(f"Span {span.spanID} operationName finalized: {operation_name}")
+        span_dict[span.spanID] = span
+
+    parent_of = {}
+    for span in span_dict.values():
+        parent_id = None
+        for ref_type, ref_span_id in span.references:
+            if ref_type == "CHILD_OF" and ref_span_id in span_dict:
+                parent_id = ref_span_id
+                parent_of[span.spanID] = parent_id
+                hierarchy[parent_id].append(span)
+                if DEBUG:
+                    debug_log(f"Linked {span.spanID} as child of {parent_id}")
+                break
+        if not parent_id:
+            roots.append(span)
+            if DEBUG:
+                debug_log(f"Root span {span.spanID}")
+
+    for span in span_dict.values():
+        if span.spanID not in hierarchy:
+            span.leafOp, span.dbSample = _leaf_label(span, processes)
+
+    # compare_subtrees walks children in operationName order; sorting them
+    # once per parent here beats re-sorting on every pairwise comparison.
+    # Kept separate from the hierarchy lists, whose insertion order drives
+    # the export span layout. The first child's service name is also cached
+    # here for the receiving-service override in extract_service_names.
+    for parent_id, children in hierarchy.items():
+        parent = span_dict[parent_id]
+        parent.sortedChildren = tuple(sorted(children, key=lambda x: x.operationName))
+        # The sorted operation-name sequence doubles as a multiset key: two
+        # parents whose children recurse pairwise must have identical
+        # sequences, so comparing these (interned-string) tuples rejects
+        # mismatched families before any per-child descent.
+        parent.childOpsKey = tuple(c.operationName for c in parent.sortedChildren)
+        parent.childService = processes.get(children[0].processID, {}).get("serviceName")
+
+    return span_dict, hierarchy, roots, parent_of
+
+def compute_subtree_metrics(span_dict, hierarchy, roots):
+    """Depth map, subtree sizes and structural signatures for every span,
+    all from one iterative post-order pass.
+
+    A single explicit-stack walk replaces three recursive traversals: it
+    avoids a Python call per descendant (and the recursion limit on deep
+    traces), and the depth/size/signature reductions all want the same
+    children-first visit order anyway.
+
+    The signature is Merkle-style, hashing operation name, processID,
+    child count, subtree size and the sorted child signatures. For a pair
+    of subtrees containing no DB span, that is exactly the set of
+    attributes compare_subtrees forces to be equal at every level, so
+    unequal signatures prove the pair cannot match and clustering can skip
+    the recursive comparison. Where DB spans are involved the comparison
+    is looser than any symmetric hash can express - it collapses QUERY
+    operation names and branches on whether the *left* subtree's children
+    contain a DB span - so the pass also records a dbFree flag per span,
+    and clustering only trusts signature inequality when both sides are
+    DB-free."""
+    depth_map = {}
+    for root in roots:
+        stack = [(root, False)]
+        while stack:
+            span, children_done = stack.pop()
+            children = hierarchy.get(span.spanID, [])
+            if children_done or not children:
+                depth_map[span.spanID] = 0 if not children else 1 + max(depth_map[child.spanID] for child in children)
+                size = 1
+                for child in children:
+                    size += child.subtreeSize
+                span.subtreeSize = size
+                span.dbFree = not span.isDb and all(child.dbFree for child in children)
+                op = span.operationName
+                if span.opIsQuery:
+                    op = "QUERY"
+                if any(child.isDb for child in children):
+                    db_count = sum(1 for child in children if child.isDb)
+                    span.sig = hash(("db", op, span.processID, len(children), size, db_count))
+                else:
+                    span.sig = hash((op, span.processID, len(children), size, tuple(sorted(child.sig for child in children))))
+            else:
+                stack.append((span, True))
+                for child in children:
+                    stack.append((child, False))
+    return depth_map
+
+def is_db_span(span):
+    return span.isDb
+
+def _time_gate(start1, dur1, start2, dur2, start_diff, gap_diff):
+    """Pure-int64 root-level time checks: start diff, gap/overlap, duration
+    tolerance. Kept free of dict access so Numba can compile it to native
+    code when available."""
+    if abs(start1 - start2) > start_diff:
+        return False
+    end1 = start1 + dur1
+    end2 = start2 + dur2
+    if end1 < start2:
+        if gap_diff >= 0 and start2 - end1 > gap_diff:
+            return False
+    elif end2 < start1:
+        if gap_diff >= 0 and start1 - end2 > gap_diff:
+            return False
+    if gap_diff < 0:  # Strict overlap
+        overlap = min(end1, end2) - max(start1, start2)
+        if overlap < -gap_diff:
+            return False
+    duration_diff = abs(dur1 - dur2)
+    max_duration = max(dur1, dur2)
+    if dur1 < 20000 and dur2 < 20000:
+        if duration_diff > 100000:
+            return False
+    else:
+        if duration_diff > 100000:
+            return False
+        if duration_diff > 0.2 * max_duration:
+            return False
+    return True
+
+if njit is not None:
+    # Explicit signature compiles the kernel eagerly at import instead of on
+    # the first comparison, so the JIT pause never lands in the timed run.
+    _time_gate = njit("boolean(int64, int64, int64, int64, int64, int64)",
+                      cache=True)(_time_gate)
+
+def _make_time_gate(start_diff, gap_diff):
+    """Root gate specialized for this run's thresholds.
+
+    The thresholds are fixed for the whole process, so the factory bakes them
+    into a closure and picks the gap or strict-overlap variant up front
+    instead of re-branching on gap_diff's sign per pair. Under numba the
+    captured values become compile-time constants. No disk cache here - a
+    cached artifact would be tied to one set of CLI thresholds anyway."""
+    if gap_diff >= 0:
+        def gate(start1, dur1, start2, dur2):
+            if abs(start1 - start2) > start_diff:
+                return False
+            end1 = start1 + dur1
+            end2 = start2 + dur2
+            if end1 < start2:
+                if start2 - end1 > gap_diff:
+                    return False
+            elif end2 < start1:
+                if start1 - end2 > gap_diff:
+                    return False
+            duration_diff = abs(dur1 - dur2)
+            if duration_diff > 100000:
+                return False
+            if dur1 < 20000 and dur2 < 20000:
+                return True
+            return duration_diff <= 0.2 * max(dur1, dur2)
+    else:
+        def gate(start1, dur1, start2, dur2):
+            if abs(start1 - start2) > start_diff:
+                return False
+            end1 = start1 + dur1
+            end2 = start2 + dur2
+            overlap = min(end1, end2) - max(start1, start2)
+            if overlap < -gap_diff:  # Strict overlap
+                return False
+            duration_diff = abs(dur1 - dur2)
+            if duration_diff > 100000:
+                return False
+            if dur1 < 20000 and dur2 < 20000:
+                return True
+            return duration_diff <= 0.2 * max(dur1, dur2)
+    if njit is not None:
+        gate = njit("boolean(int64, int64, int64, int64)")(gate)
+    return gate
+
+_root_time_gate = _make_time_gate(start_difference, gap_difference)
+
+def _window_gate_numpy(c_starts, c_durations, root_start, root_dur, gap_diff):
+    """Vectorized root time gate over a window of candidates that all start at
+    or after the root (so only the trailing-gap branch can apply)."""
+    root_end = root_start + root_dur
+    if gap_diff >= 0:
+        gate = (c_starts - root_end) <= gap_diff
+    else:  # Strict overlap
+        gate = (np.minimum(root_end, c_starts + c_durations) - c_starts) >= -gap_diff
+    duration_diff = np.abs(c_durations - root_dur)
+    gate &= duration_diff <= 100_000
+    both_short = (c_durations < 20_000) & (root_dur < 20_000)
+    gate &= both_short | (duration_diff <= 0.2 * np.maximum(c_durations, root_dur))
+    return gate
+
+if njit is not None:
+    # Same gate as a fused native loop: one pass over the window instead of
+    # the half-dozen temporary arrays the NumPy expression allocates.
+    @njit("boolean[:](int64[:], int64[:], int64, int64, int64)", cache=True)
+    def _window_gate(c_starts, c_durations, root_start, root_dur, gap_diff):
+        n = c_starts.shape[0]
+        out = np.empty(n, dtype=np.bool_)
+        root_end = root_start + root_dur
+        for k in range(n):
+            out[k] = _time_gate(root_start, root_dur, c_starts[k], c_durations[k],
+                                np.int64(2**62), gap_diff)
+        return out
+else:
+    _window_gate = _window_gate_numpy
+
+# Requesting/receiving service pair per spanID. The answer is a pure
+# function of the trace, and summarize asks for the same cluster roots
+# repeatedly; cleared alongside _cmp_cache per input file.
+_svc_cache = {}
+
+def extract_service_names(span, processes, span_dict, parent_of):
+    cached = _svc_cache.get(span.spanID)
+    if cached is not None:
+        return cached
+    result = _extract_service_names(span, processes, span_dict, parent_of)
+    _svc_cache[span.spanID] = result
+    return result
+
+def _extract_service_names(span, processes, span_dict, parent_of):
+    tags = span.tags
+    process = processes.get(span.processID, {})
+    service_name = process.get("serviceName") or "Unknown"
+    span_kind = tags.get("span.kind", "client")
+    if span_kind == "server":
+        requesting = "Unknown"
+        receiving = service_name
+        # parent_of already holds the first CHILD_OF parent, so no need to
+        # re-scan the references here.
+        parent_id = parent_of.get(span.spanID)
+        if parent_id is not None:
+            parent_process = processes.get(span_dict[parent_id].processID, {})
+            requesting = parent_process.get("serviceName") or "Unknown"
+    else:
+        requesting = service_name
+        receiving = tags.get("server.address")
+        if not receiving and "http.url" in tags:
+            hostname, _ = _parse_url(tags["http.url"])
+            receiving = hostname or "Unknown"
+        if not receiving:
+            receiving = tags.get("net.peer.name", "Unknown")
+        # The first child's service name was resolved during the hierarchy
+        # build, so the override is a single slot read.
+        if span.childService is not None:
+            receiving = span.childService
+            if DEBUG:
+                debug_log(f"Span {span.spanID} - Overrode receiving to first child's service: {receiving}")
+    if DEBUG:
+        debug_log(f"Span {span.spanID} - Requesting: {requesting}, Receiving: {receiving}, Kind: {span_kind}, URL: {tags.get('http.url', 'N/A')}")
+    return requesting, receiving
+
+def extract_status_code(tags):
+    return tags.get("http.response.status_code", tags.get("http.status_code", "N/A"))
+
+# Pairwise comparison results keyed by canonically-ordered spanID pair.
+# The same child pairs get re-entered many times across the clustering loop;
+# all checks are symmetric, so one cached verdict covers both orderings. Root
+# level additionally applies the time gates, hence the is_root key component.
+_cmp_cache = {}
+
+def compare_subtrees(span1, span2, span_dict, hierarchy, processes, depth_map, depth):
+    id1 = span1.spanID
+    id2 = span2.spanID
+    key = (id1, id2, depth == 0) if id1 < id2 else (id2, id1, depth == 0)
+    hit = _cmp_cache.get(key)
+    if hit is not None:
+        return hit
+    result = _compare_subtrees(span1, span2, span_dict, hierarchy, processes, depth_map, depth)
+    _cmp_cache[key] = result
+    return result
+
+def _compare_subtrees(span1, span2, span_dict, hierarchy, processes, depth_map, depth):
+    # Explicit worklist instead of recursion: deep traces no longer grow the
+    # Python call stack, and every descendant pair gets a cache probe before
+    # any checks run on it. Pairs that pass their local checks are cached as
+    # matches only once the whole comparison has succeeded; a locally failing
+    # pair is cached as a mismatch immediately.
+    stack = [(span1, span2, depth)]
+    passed = []
+    while stack:
+        s1, s2, d = stack.pop()
+        if d > depth:
+            key = (s1.spanID, s2.spanID, False) if s1.spanID < s2.spanID else (s2.spanID, s1.spanID, False)
+            hit = _cmp_cache.get(key)
+            if hit is True:
+                continue
+            if hit is False:
+                return False
+        else:
+            key = None  # the root pair is cached by the compare_subtrees wrapper
+
+        if DEBUG:
+            debug_log(f"Comparing spans {s1.spanID} vs {s2.spanID} at depth {d}")
+
+        # Cheapest and most selective rejections first: operationName equality
+        # (pointer-fast thanks to interning), then child count - before paying
+        # for any time arithmetic on pairs that cannot match anyway.
+        if s1.operationName != s2.operationName:
+            if not (s1.opIsQuery and s2.opIsQuery):
+                if DEBUG:
+                    debug_log(f"Span {s1.spanID} vs {s2.spanID} - operationName mismatch: {s1.operationName} vs {s2.operationName}")
+                if key is not None:
+                    _cmp_cache[key] = False
+                return False
+            if DEBUG:
+                debug_log(f"Span {s1.spanID} vs {s2.spanID} - DB QUERY operations treated as equivalent")
+
+        children1 = hierarchy.get(s1.spanID, [])
+        children2 = hierarchy.get(s2.spanID, [])
+        if len(children1) != len(children2):
+            if DEBUG:
+                debug_log(f"Span {s1.spanID} vs {s2.spanID} - child count mismatch: {len(children1)} vs {len(children2)}")
+            if key is not None:
+                _cmp_cache[key] = False
+            return False
+
+        # Check processID to ensure same requesting service
+        if s1.processID != s2.processID:
+            if DEBUG:
+                service1 = processes.get(s1.processID, {}).get("serviceName", "Unknown")
+                service2 = processes.get(s2.processID, {}).get("serviceName", "Unknown")
+                debug_log(f"Span {s1.spanID} (service: {service1}) vs {s2.spanID} (service: {service2}) - processID mismatch")
+            if key is not None:
+                _cmp_cache[key] = False
+            return False
+
+        # depth_map already holds every span's max subtree depth, computed once
+        # in find_duplicate_spans - no need to re-walk the subtree per pair.
+        depth1 = depth_map[s1.spanID]
+        depth2 = depth_map[s2.spanID]
+        if DEBUG:
+            debug_log(f"Depth check: {s1.spanID} depth {depth1}, {s2.spanID} depth {depth2}")
+        if d == 0 and (depth1 < 2 or depth2 < 2 or depth1 != depth2):
+            if DEBUG:
+                debug_log(f"Span {s1.spanID} vs {s2.spanID} - root depth mismatch or < 2: {depth1} vs {depth2}")
+            return False
+
+        span_count1 = s1.subtreeSize
+        span_count2 = s2.subtreeSize
+        if DEBUG:
+            debug_log(f"Span count: {s1.spanID} has {span_count1}, {s2.spanID} has {span_count2}")
+        if span_count1 != span_count2:
+            if DEBUG:
+                debug_log(f"Span {s1.spanID} vs {s2.spanID} - total span count mismatch: {span_count1} vs {span_count2}")
+            if key is not None:
+                _cmp_cache[key] = False
+            return False
+
+        if d == 0:
+            if not _root_time_gate(s1.startTime, s1.duration,
+                                   s2.startTime, s2.duration):
+                if DEBUG:
+                    debug_log(f"Span {s1.spanID} vs {s2.spanID} - failed root time gate (start/gap/duration checks)")
+                return False
+
+        if DEBUG:
+            debug_log(f"Span {s1.spanID} children: {[c.spanID + ' ' + c.operationName for c in children1]}")
+            debug_log(f"Span {s2.spanID} children: {[c.spanID + ' ' + c.operationName for c in children2]}")
+
+        if not children1 and not children2:
+            if DEBUG:
+                debug_log(f"Span {s1.spanID} vs {s2.spanID} - leaf nodes match")
+        elif any(is_db_span(c) for c in children1):
+            query_count1 = sum(1 for c in children1 if is_db_span(c))
+            query_count2 = sum(1 for c in children2 if is_db_span(c))
+            if DEBUG:
+                debug_log(f"Query count: {s1.spanID} has {query_count1}, {s2.spanID} has {query_count2}")
+            if query_count1 != query_count2:
+                if DEBUG:
+                    debug_log(f"Span {s1.spanID} vs {s2.spanID} - DB query count mismatch: {query_count1} vs {query_count2}")
+                if key is not None:
+                    _cmp_cache[key] = False
+                return False
+            if DEBUG:
+                debug_log(f"Span {s1.spanID} vs {s2.spanID} - DB query counts match: {query_count1}")
+        else:
+            # One tuple compare over the sorted child operation names rejects
+            # whole families without descending: in this branch no child is a
+            # DB span, so the per-child check would demand exact operation
+            # name equality position by position anyway.
+            if s1.childOpsKey != s2.childOpsKey:
+                if DEBUG:
+                    debug_log(f"Span {s1.spanID} vs {s2.spanID} - child operation multiset mismatch")
+                if key is not None:
+                    _cmp_cache[key] = False
+                return False
+            for c1, c2 in zip(s1.sortedChildren, s2.sortedChildren):
+                stack.append((c1, c2, d + 1))
+
+        if key is not None:
+            passed.append(key)
+
+    for key in passed:
+        _cmp_cache[key] = True
+    if DEBUG:
+        debug_log(f"Span {span1.spanID} vs {span2.spanID} - subtrees match fully")
+    return True
+    
+def cluster_parallel_subtrees(spans, span_dict, hierarchy, processes, depth_map, span_index, starts, durations, parent_id, depth):
+    if DEBUG:
+        debug_log(f"Clustering spans for parent {parent_id} at depth {depth}: {[s.spanID + ' ' + s.operationName for s in spans]}")
+    spans = sorted(spans, key=lambda x: x.startTime)
+
+    clusters = []
+    # Only same-operation spans can cluster together (the prefilter already
+    # demanded equal operationName), so partition the group once by operation
+    # and run the quadratic scan per bucket. Interned names make the bucket
+    # key lookup a pointer compare.
+    buckets = {}
+    for s in spans:
+        buckets.setdefault(s.operationName, []).append(s)
+    for bucket in buckets.values():
+        # Gather the bucket's slice of the global SoA arrays once; consumed
+        # spans are tracked with a flag vector instead of rebuilding lists.
+        idx = np.fromiter((span_index[s.spanID] for s in bucket), dtype=np.intp, count=len(bucket))
+        bucket_starts = starts[idx]
+        bucket_durations = durations[idx]
+        used = np.zeros(len(bucket), dtype=bool)
+        for i, root in enumerate(bucket):
+            if used[i]:
+                continue
+            used[i] = True
+            if DEBUG:
+                debug_log(f"Processing root span {root.spanID} - {root.operationName}")
+            if is_db_span(root):
+                if DEBUG:
+                    debug_log(f"Skipping span {root.spanID} - root is a DB query")
+                continue
+            cluster = [(root, root.subtreeSize)]
+            # bucket_starts is sorted, so the start-difference window ends at
+            # a searchsorted cutoff instead of a per-candidate test.
+            hi = int(np.searchsorted(bucket_starts, root.startTime + start_difference, side="right"))
+            # Batch replica of the root-level _time_gate over the whole
+            # window: candidates failing the numeric gates never reach the
+            # recursive structural comparison.
+            gate = _window_gate(bucket_starts[i + 1:hi], bucket_durations[i + 1:hi],
+                                root.startTime, root.duration, gap_difference)
+            for offset in np.nonzero(gate)[0]:
+                j = i + 1 + offset
+                if used[j]:
+                    continue
+                candidate = bucket[j]
+                # Unequal structural signatures prove the recursive comparison
+                # would fail, but only for DB-free subtree pairs - the DB
+                # handling in compare_subtrees is asymmetric and collapses
+                # QUERY names, which no symmetric hash can mirror. Anything
+                # touching a DB span pays for the full verify.
+                if root.dbFree and candidate.dbFree and candidate.sig != root.sig:
+                    if DEBUG:
+                        debug_log(f"No match between {root.spanID} and {candidate.spanID} - structural signature differs")
+                    continue
+                if DEBUG:
+                    debug_log(f"Comparing root {root.spanID} (start: {root.startTime}, dur: {root.duration}) vs candidate {candidate.spanID} (start: {candidate.startTime}, dur: {candidate.duration})")
+                if compare_subtrees(root, candidate, span_dict, hierarchy, processes, depth_map, 0):
+                    cluster.append((candidate, candidate.subtreeSize))
+                    used[j] = True
+                    if DEBUG:
+                        debug_log(f"Added {candidate.spanID} to cluster with root {root.spanID}")
+                else:
+                    if DEBUG:
+                        debug_log(f"No match between {root.spanID} and {candidate.spanID} - failed criteria")
+            if DEBUG:
+                debug_log(f"Finished clustering attempt with root {root.spanID}, cluster size: {len(cluster)}")
+            if len(cluster) >= 2:
+                clusters.append(cluster)
+                if DEBUG:
+                    debug_log(f"Cluster formed for parent {parent_id} at depth {depth}: {[s[0].spanID for s in cluster]}")
+            else:
+                if DEBUG:
+                    debug_log(f"Span {root.spanID} not clustered - no matches found")
+    
+    if DEBUG:
+        debug_log(f"Clustering complete for parent {parent_id} at depth {depth} - {len(clusters)} clusters formed")
+    return clusters
+
+def _parse_trace_streaming(file_path):
+    """Event-streaming fallback for trace files too large to load in one piece.
+
+    The file is opened in binary mode: ijson consumes raw bytes and decodes
+    JSON strings itself, so no UTF-8/Latin-1 fallback dance is needed."""
+    spans = []
+    processes = {}
+    trace_id = None
+    debug_log("Starting streaming parse")
+    # 1MB buffer: the C-backend parser pulls large chunks, so a default-size
+    # buffer would just multiply read syscalls on multi-GB files.
+    with open(file_path, "rb", buffering=1 << 20) as file:
+        for raw_span in ijson.items(file, "data.item.spans.item", use_float=True):
+            span = _shape_span(raw_span)
+            if span is not None:
+                spans.append(span)
+                if DEBUG:
+                    debug_log(f"Span added: {span.spanID}")
+        file.seek(0)
+        for value in ijson.items(file, "data.item.traceID", use_float=True):
+            trace_id = value
+            if DEBUG:
+                debug_log(f"Trace ID: {trace_id}")
+        file.seek(0)
+        for pid, process in ijson.kvitems(file, "data.item.processes", use_float=True):
+            if pid.startswith("p") and pid[1:].isdigit() and "serviceName" in process:
+                if pid not in processes:
+                    processes[pid] = {}
+                processes[pid]["serviceName"] = _intern(process["serviceName"])
+    return spans, processes, trace_id
+
+def _shape_span(raw_span):
+    """Shape one raw span from the parsed document into a Span, or None if the
+    span lacks the identifying fields."""
+    if "spanID" not in raw_span or "startTime" not in raw_span or "duration" not in raw_span:
+        return None
+    tags = {}
+    for tag in raw_span.get("tags", []):
+        key = tag.get("key")
+        value = tag.get("value")
+        if key is None or value is None or isinstance(value, (bool, dict, list)):
+            continue
+        tags[_intern(str(key).replace("http.method", "http.request.method"))] = str(value)
+    # Span/process IDs and ref types repeat across thousands of spans;
+    # interning collapses the duplicate strings and makes the hierarchy and
+    # parent_of dict lookups hash/compare on shared pointers.
+    references = tuple(
+        (_intern(raw_ref["refType"]) if "refType" in raw_ref else None,
+         _intern(raw_ref["spanID"]) if "spanID" in raw_ref else None)
+        for raw_ref in raw_span.get("references", ())
+    )
+    # Pull the operation-name ingredients out of the tags dict once, while it
+    # is hot, so build_span_hierarchy reads slots instead of re-probing the
+    # same keys per span. httpMethod is None only when no method tag exists
+    # (the http.method key was renamed to http.request.method above).
+    http_method = tags.get("http.request.method")
+    http_path = None
+    if http_method is not None:
+        http_path = tags.get("http.target") or tags.get("url.path") or tags.get("http.route") or tags.get("url.full") or None
+        if http_path is None and "http.url" in tags:
+            http_path = extract_path_from_url(tags["http.url"])
+    return Span(
+        spanID=_intern(raw_span["spanID"]),
+        startTime=int(raw_span["startTime"]),
+        duration=int(raw_span["duration"]),
+        processID=_intern(raw_span.get("processID", "")),
+        operationName=raw_span.get("operationName", "UNKNOWN"),
+        tags=tags,
+        references=references,
+        isDb="db.statement" in tags,
+        httpMethod=http_method,
+        httpPath=http_path,
+        dbStatement=tags.get("db.statement"),
+        dbTable=tags.get("db.sql.table", "unknown_table"),
+    )
+
+def _parse_trace(file_path):
+    """Parse the whole trace file in one shot with orjson - much faster than
+    walking every JSON token in Python."""
+    with open(file_path, "rb") as file:
+        raw = file.read()
+    try:
+        doc = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        debug_log("UTF-8 decoding failed, falling back to Latin-1")
+        doc = orjson.loads(raw.decode("latin-1").encode("utf-8"))
+
+    spans = []
+    processes = {}
+    trace_id = None
+    debug_log("Starting bulk parse with orjson")
+    for trace in doc.get("data", []):
+        if "traceID" in trace:
+            trace_id = trace["traceID"]
+            if DEBUG:
+                debug_log(f"Trace ID: {trace_id}")
+        for pid, process in trace.get("processes", {}).items():
+            if pid.startswith("p") and pid[1:].isdigit() and "serviceName" in process:
+                if pid not in processes:
+                    processes[pid] = {}
+                processes[pid]["serviceName"] = _intern(process["serviceName"])
+        for raw_span in trace.get("spans", []):
+            span = _shape_span(raw_span)
+            if span is not None:
+                spans.append(span)
+                if DEBUG:
+                    debug_log(f"Span added: {span.spanID}")
+    return spans, processes, trace_id
+
+def find_duplicate_spans(file_path):
+    _cmp_cache.clear()
+    _svc_cache.clear()
+    if os.path.getsize(file_path) > STREAMING_THRESHOLD:
+        spans, processes, trace_id = _parse_trace_streaming(file_path)
+    else:
+        spans, processes, trace_id = _parse_trace(file_path)
+
+    if not spans or not trace_id:
+        debug_log(f"Spans: {len(spans)}, Trace ID: {trace_id}")
+        print("No valid spans or trace ID found.")
+        sys.exit(1)
+
+    span_dict, hierarchy, roots, parent_of = build_span_hierarchy(spans, processes)
+    depth_map = compute_subtree_metrics(span_dict, hierarchy, roots)
+
+    # Structure-of-arrays view of the timing fields, built once and shared by
+    # every cluster_parallel_subtrees call via span_index lookups.
+    span_index = {span_id: i for i, span_id in enumerate(span_dict)}
+    starts = np.fromiter((s.startTime for s in span_dict.values()), dtype=np.int64, count=len(span_dict))
+    durations = np.fromiter((s.duration for s in span_dict.values()), dtype=np.int64, count=len(span_dict))
+
+    # Parent grouping straight off the hierarchy's child lists: those were
+    # filled in span_dict order during the build, so filtering each list by
+    # depth reproduces the old per-span scan (same members, same order)
+    # without re-resolving every span's parent.
+    parent_groups = {}
+    for parent_id, children in hierarchy.items():
+        group = [child for child in children if depth_map[child.spanID] >= 1]
+        if group:
+            parent_groups[parent_id] = group
+
+    # Parent groups only share read-only state (span_dict, hierarchy,
+    # processes, the SoA arrays), so clustering them is embarrassingly
+    # parallel. A thread pool overlaps the numpy/numba gate work without
+    # pickling the trace the way a process pool would; results are collected
+    # in submission order so duplicate_groups keeps the serial loop's
+    # ordering for the summaries and export.
+    duplicate_groups = {}
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        pending = []
+        for parent_id, group in parent_groups.items():
+            if DEBUG:
+                debug_log(f"Group for parent {parent_id}: {[s.spanID + ' ' + s.operationName for s in group]}")
+            if len(group) > 1:
+                if DEBUG:
+                    debug_log(f"Processing group for parent {parent_id} with {len(group)} spans")
+                pending.append((parent_id, executor.submit(
+                    cluster_parallel_subtrees, group, span_dict, hierarchy, processes,
+                    depth_map, span_index, starts, durations, parent_id, 0)))
+            elif DEBUG:
+                debug_log(f"Skipping clustering for parent {parent_id} - no duplicates (size: {len(group)})")
+        for parent_id, future in pending:
+            clusters = future.result()
+            if clusters:
+                duplicate_groups[parent_id] = clusters
+            elif DEBUG:
+                debug_log(f"No clusters formed for parent {parent_id}")
+
+    if DEBUG:
+        debug_log(f"Final processes dict: {processes}")
+        debug_log(f"Depth map: {depth_map}")
+    return duplicate_groups, trace_id, processes, span_dict, hierarchy, parent_of, depth_map
+
+def summarize_duplicates(duplicate_groups, trace_id, processes, span_dict, hierarchy, parent_of, depth_map):
+    lines = [f"\nRelated Subtrees in Trace ID: {trace_id}\n"]
+    if not duplicate_groups:
+        lines.append("No matching parallel subtrees found.")
+        return "\n".join(lines), {}
+
+    # Each cluster's first root is walked twice (once for the report, once
+    # for the export data), so cache completed walks by root spanID. The
+    # hierarchy doesn't change during summarization, making this safe.
+    leaf_ops_cache = {}
+
+    def get_leaf_operations_with_depth(span, hierarchy):
+        cached = leaf_ops_cache.get(span.spanID)
+        if cached is not None:
+            return cached
+        # Explicit stack instead of recursion - deep traces otherwise hit the
+        # interpreter's frame limit. Children go on reversed so leaves come
+        # out in the recursive left-to-right order.
+        leaf_ops = []
+        stack = [(span, 0)]
+        while stack:
+            node, depth = stack.pop()
+            kids = hierarchy.get(node.spanID, [])
+            if not kids:
+                # Label and sample were precomputed in build_span_hierarchy.
+                leaf_ops.append((node.leafOp, depth, node.dbSample, node.spanID))
+            else:
+                for child in reversed(kids):
+                    stack.append((child, depth + 1))
+        leaf_ops_cache[span.spanID] = leaf_ops
+        return leaf_ops
+
+    grouped_clusters = defaultdict(list)
+    for parent_id, clusters in sorted(duplicate_groups.items()):
+        for cluster in clusters:
+            operation = cluster[0][0].operationName
+            grouped_clusters[(parent_id, operation)].append(cluster)
+
+    cluster_leaf_ops = {}
+    for (parent_id, operation), clusters in sorted(grouped_clusters.items()):
+        span = span_dict[parent_id]
+        parent_op = span.operationName
+        parent_service, _ = extract_service_names(span, processes, span_dict, parent_of)
+        if span.tags.get("span.kind") == "server":
+            parent_service = processes.get(span.processID, {}).get("serviceName", "Unknown")
+        
+        lines.append(f"Parent: {parent_service} - {parent_op} (Span ID: {parent_id})")
+        lines.append(f"Operation: {operation}")
+        
+        for cluster_idx, cluster in enumerate(clusters[:10]):
+            req, rec = extract_service_names(cluster[0][0], processes, span_dict, parent_of)
+            depth = depth_map[cluster[0][0].spanID]
+            total_spans = sum(count for _, count in cluster)
+            lines.append(f"- Requesting: {req}, Receiving: {rec} (Size: {len(cluster)}, Depth: {depth}, Spans: {total_spans}):")
+            lines.append("\n".join(
+                f"  Subtree Root {j} - ID: {span.spanID}, Start: {span.startDisplay}, Duration: {span.duration}us, Status: {extract_status_code(span.tags)}"
+                for j, (span, _) in enumerate(cluster[:5], 1)
+            ))
+            if len(cluster) > 5:
+                lines.append(f"    ...and {len(cluster) - 5} more subtrees")
+            
+            leaf_ops_with_depth = get_leaf_operations_with_depth(cluster[0][0], hierarchy)
+            total_leaves = len(leaf_ops_with_depth)
+            if DEBUG:
+                debug_log(f"Cluster {operation} under parent {parent_id}: Total leaves = {total_leaves}")
+            # Bucket counts and first samples in one pass; Counter plus a
+            # next() scan per op walked each depth bucket repeatedly.
+            depth_ops = defaultdict(dict)
+            for op, d, sample, span_id in leaf_ops_with_depth:
+                slot = depth_ops[d].setdefault(op, [0, sample])
+                slot[0] += 1
+            lines.append(f"  Leaf Operations by Depth: Total {total_leaves}")
+            for d in sorted(depth_ops.keys()):
+                lines.append(f"    Depth {d}:")
+                for op, (count, sample) in depth_ops[d].items():
+                    if "DB QUERY" in op and sample:
+                        lines.append(f"      {count:<2} {op} (e.g., {sample})")
+                    else:
+                        lines.append(f"      {count:<2} {op}")
+            lines.append("")
+
+            cluster_key = f"{parent_id}:{operation}"
+            all_leaf_ops = []
+            for subtree_idx, (root_span, _) in enumerate(cluster):
+                subtree_leaves = get_leaf_operations_with_depth(root_span, hierarchy)
+                all_leaf_ops.extend(subtree_leaves)
+                if DEBUG:
+                    debug_log(f"Collected {len(subtree_leaves)} leaf ops from subtree {subtree_idx} in cluster {cluster_key}")
+
+            # The export only needs spanID -> (operation, first sample seen
+            # for that op at that depth), so store that flat map directly
+            # instead of a by-depth structure the export would immediately
+            # flatten back. Spans of the same (depth, op) share one entry,
+            # preserving the old first-sample semantics.
+            span_ops = {}
+            op_entries = {}
+            for op, d, sample, sid in all_leaf_ops:
+                entry = op_entries.get((d, op))
+                if entry is None:
+                    op_entries[(d, op)] = entry = {"operation": op, "sample": sample}
+                span_ops[sid] = entry
+            cluster_leaf_ops[cluster_key] = span_ops
+        lines.append("-" * 40)
+
+    return "\n".join(lines), cluster_leaf_ops
+
+def get_subtree_spans(root_span, hierarchy, span_dict, cache=None):
+    """Collect all spans in the subtree rooted at root_span, preserving hierarchy.
+
+    Iterative preorder (children pushed in reverse keep the recursive
+    root-then-left-to-right order); an optional cache keyed by root spanID
+    lets the export reuse flat lists for roots it visits more than once."""
+    if cache is not None:
+        cached = cache.get(root_span.spanID)
+        if cached is not None:
+            return cached
+    spans = []
+    stack = [root_span]
+    while stack:
+        span = stack.pop()
+        spans.append(span)
+        children = hierarchy.get(span.spanID, [])
+        if children:
+            stack.extend(reversed(children))
+    if cache is not None:
+        cache[root_span.spanID] = spans
+    return spans
+
+# Exact-type dispatch for tag typing. bool maps to "int64" on purpose: the
+# old isinstance chain tested int first and bool is an int subclass, so the
+# "bool" branch was unreachable - keep the emitted JSON identical.
+_TAG_TYPES = {int: "int64", bool: "int64", float: "float64"}
+
+def convert_tags_to_jaeger_format(tags_dict):
+    """Convert a dictionary of tags to Jaeger's expected list of tag objects."""
+    return [
+        {"key": key, "type": _TAG_TYPES.get(type(value), "string"), "value": value}
+        for key, value in tags_dict.items()
+    ]
+
+def export_clustered_traces_json(duplicate_groups, trace_id, processes, span_dict, hierarchy, cluster_leaf_ops, output_file="clustered_traces.json"):
+    """Export each cluster of matching subtrees as a single trace in Jaeger-compatible JSON format, preserving original spanIDs and parent operation."""
+    if not duplicate_groups:
+        debug_log("No duplicate groups found to export.")
+        return
+
+    output_data = []
+    subtree_cache = {}
+    grouped_clusters = defaultdict(list)
+    for parent_id, clusters in duplicate_groups.items():
+        for cluster in clusters:
+            operation = cluster[0][0].operationName
+            grouped_clusters[(parent_id, operation)].append(cluster)
+
+    for (parent_id, operation), clusters in sorted(grouped_clusters.items()):
+        cluster_key = f"{parent_id}:{operation}"
+        span_op_map = cluster_leaf_ops.get(cluster_key, {})
+
+        for cluster_idx, cluster in enumerate(clusters):
+            total_subtree_spans = sum(count for _, count in cluster)
+            cluster_size = len(cluster)
+            spans_per_subtree = total_subtree_spans // cluster_size
+            if DEBUG:
+                debug_log(f"Cluster {cluster_idx + 1} under parent {parent_id}, operation {operation} has size: {cluster_size}, total subtree spans: {total_subtree_spans}, spans per subtree: {spans_per_subtree}")
+
+            new_trace_id = str(uuid.uuid4()).replace("-", "")
+            parent_span = span_dict.get(parent_id)
+            if not parent_span:
+                if DEBUG:
+                    debug_log(f"Warning: Parent span {parent_id} not found in span_dict for cluster {cluster_idx + 1}")
+                continue
+
+            first_subtree_root = cluster[0][0]
+            requesting_service = processes.get(first_subtree_root.processID, {}).get("serviceName", "Unknown")
+            subtree_operation = first_subtree_root.operationName
+
+            all_spans = [parent_span]
+            seen_span_ids = {parent_span.spanID}
+            # Which subtree each span was first collected under. Deriving the
+            # index later as (span_idx - 1) // spans_per_subtree assumed all
+            # subtrees were the same size, which isn't guaranteed.
+            subtree_idx_by_span = {}
+
+            for subtree_idx, (root_span, _) in enumerate(cluster):
+                subtree_spans = get_subtree_spans(root_span, hierarchy, span_dict, subtree_cache)
+                if DEBUG:
+                    debug_log(f"Subtree {subtree_idx + 1} in cluster {cluster_idx + 1} has {len(subtree_spans)} spans")
+                for span in subtree_spans:
+                    if span.spanID not in seen_span_ids:
+                        all_spans.append(span)
+                        seen_span_ids.add(span.spanID)
+                        subtree_idx_by_span[span.spanID] = subtree_idx
+
+            # One comprehension over the final span list instead of .add()
+            # calls threaded through the build loop below.
+            involved_processes = {s.processID for s in all_spans if s.processID}
+
+            new_spans = []
+            total_spans_excluding_parent = len(all_spans) - 1
+            total_spans_in_trace = len(all_spans)
+            if DEBUG:
+                debug_log(f"Total spans in trace (including parent): {total_spans_in_trace}, reported spans (excluding parent): {total_spans_excluding_parent}")
+
+            for span_idx, span in enumerate(all_spans):
+                operation_name = span.operationName
+                if span.spanID in span_op_map:
+                    operation_name = span_op_map[span.spanID]["operation"]
+                    if DEBUG:
+                        debug_log(f"Updated span {span.spanID} from {span.operationName} to {operation_name}")
+
+                new_references = [
+                    {"refType": ref_type, "spanID": ref_span_id, "traceID": new_trace_id}
+                    for ref_type, ref_span_id in span.references
+                ]
+
+                # Spans are slotted objects internally; the export materializes
+                # a plain dict per span in the Jaeger layout.
+                new_span = {
+                    "traceID": new_trace_id,
+                    "spanID": span.spanID,
+                    "operationName": operation_name,
+                    "startTime": span.startTime,
+                    "duration": span.duration,
+                    "references": new_references,
+                    "tags": convert_tags_to_jaeger_format(span.tags),
+                    "logs": [],
+                    "warnings": None,
+                }
+                if span.processID:
+                    new_span["processID"] = span.processID
+
+                if span_idx == 0:  # Parent span
+                    original_operation = new_span["operationName"]  # Keep as is
+                    new_span["tags"].extend([
+                        {"key": "original.operationName", "type": "string", "value": original_operation},
+                        {"key": "clustered.operationName", "type": "string", "value": subtree_operation},  # Add subtree operation as a tag
+                        {"key": "cluster.group", "type": "string", "value": f"{parent_id}:{operation}"},
+                        {"key": "cluster.size", "type": "int64", "value": cluster_size},
+                        {"key": "cluster.total_subtree_spans", "type": "int64", "value": total_subtree_spans},
+                        {"key": "spans.per.subtree", "type": "int64", "value": spans_per_subtree},
+                        {"key": "reported.spans.in.trace", "type": "int64", "value": total_spans_excluding_parent},
+                        {"key": "actual.spans.in.trace", "type": "int64", "value": total_spans_in_trace}
+                    ])
+                else:
+                    new_span["tags"].append({"key": "subtree.index", "type": "int64", "value": subtree_idx_by_span[span.spanID]})
+                    new_span["tags"].append({"key": "cluster.group", "type": "string", "value": f"{parent_id}:{operation}"})
+                    if span.spanID in span_op_map and span_op_map[span.spanID]["sample"]:
+                        new_span["tags"].append({
+                            "key": "db.statement.sample",
+                            "type": "string",
+                            "value": span_op_map[span.spanID]["sample"]
+                        })
+
+                new_spans.append(new_span)
+
+            trace_processes = {pid: processes[pid] for pid in involved_processes if pid in processes}
+            output_data.append({
+                "traceID": new_trace_id,
+                "spans": new_spans,
+                "processes": trace_processes
+            })
+            if DEBUG:
+                debug_log(f"Exported trace {new_trace_id} for cluster {cluster_idx + 1} under parent {parent_id}, operation {operation}, total spans in this trace: {len(new_spans)}, reported spans: {total_spans_excluding_parent}")
+
+    output_json = {"data": output_data}
+    try:
+        # orjson serializes in C and writes bytes in one shot; stdlib json's
+        # indent walker was the slowest part of large exports. Two-space
+        # indent instead of four - consumers parse this file, no one diffs it.
+        with open(output_file, "wb") as f:
+            f.write(orjson.dumps(output_json, option=orjson.OPT_INDENT_2))
+        debug_log(f"Successfully wrote {len(output_data)} clustered traces to {output_file}")
+        print(f"Clustered traces exported to {output_file} with {len(output_data)} traces")
+        print("Note: Each trace includes the parent span and all matching subtrees. The 'reported.spans.in.trace' tag excludes the parent to match log.txt, while Jaeger UI shows all spans including the parent.")
+    except Exception as e:
+        debug_log(f"Error writing JSON output: {str(e)}")
+        print(f"Error writing JSON output: {e}", file=sys.stderr)
+        
+if __name__ == "__main__":
+    try:
+        duplicate_groups, trace_id, processes, span_dict, hierarchy, parent_of, depth_map = find_duplicate_spans(trace_file)
+        log_output, cluster_leaf_ops = summarize_duplicates(duplicate_groups, trace_id, processes, span_dict, hierarchy, parent_of, depth_map)
+        print(log_output)
+        # Add the export of clustered traces with leaf operations
+        export_clustered_traces_json(duplicate_groups, trace_id, processes, span_dict, hierarchy, cluster_leaf_ops)
+    except Exception as e:
+        debug_log(f"Error: {str(e)}")
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if debug_file:
+            debug_file.close()
@@ -1,423 +1,726 @@
-# -*- coding: utf-8 -*-
-import ijson
-from collections import defaultdict
-from datetime import datetime
-import sys
-from urllib.parse import urlparse
-
-sys.stdout.reconfigure(encoding='utf-8')
-
-if len(sys.argv) < 2:
-    print("Usage: python detect_duplicates.py <path_to_trace_file>")
-    sys.exit(1)
-
-trace_file = sys.argv[1]
-
-try:
-    debug_file = open("debug_log.txt", "w", encoding='utf-8')
-except IOError as e:
-    print(f"Failed to open debug log file: {e}")
-    sys.exit(1)
-
-def debug_log(message):
-    try:
-        print(f"[DEBUG] {message}", file=debug_file)
-        debug_file.flush()
-    except Exception as e:
-        print(f"Failed to write to debug log file: {e}")
-
-def parse_time(timestamp):
-    return datetime.fromtimestamp(timestamp / 1_000_000)
-
-def extract_path_from_url(url):
-    parsed_url = urlparse(url)
-    return parsed_url.path
-
-def build_span_hierarchy(spans):
-    span_dict = {}
-    hierarchy = defaultdict(list)
-    roots = []
-    for span in spans:
-        tags = span.get("tags", {})
-        if "operationName" not in span or span["operationName"] in ["GET", "POST", "PUT", "DELETE"]:
-            method = tags.get("http.request.method") or tags.get("http.method") or "UNKNOWN"
-            path = tags.get("url.full") or tags.get("http.target") or tags.get("url.path") or tags.get("http.route")
-            if path is None and "http.url" in tags:
-                path = extract_path_from_url(tags["http.url"])
-            if path is None:
-                path = "/*" if "http.method" in tags or "http.request.method" in tags else "Unknown Operation"
-            span["operationName"] = f"{method} {path}" if path else span.get("operationName", "Unknown Operation")
-        span_dict[span["spanID"]] = span
-        debug_log(f"Built span {span['spanID']} with operationName: {span['operationName']}")
-
-    for span in span_dict.values():
-        parent_id = None
-        refs = span.get("references", [])
-        for ref in refs:
-            if ref["refType"] == "CHILD_OF" and ref["spanID"] in span_dict:
-                parent_id = ref["spanID"]
-                hierarchy[parent_id].append(span)
-                break
-        if not parent_id:
-            roots.append(span)
-
-    return span_dict, hierarchy, roots
-
-def get_hierarchy_depth(span_dict, hierarchy, span_id, memo=None):
-    if memo is None:
-        memo = {}
-    if span_id in memo:
-        return memo[span_id]
-    children = hierarchy.get(span_id, [])
-    depth = 0 if not children else 1 + max(get_hierarchy_depth(span_dict, hierarchy, child["spanID"], memo) for child in children)
-    memo[span_id] = depth
-    return depth
-
-def extract_service_names(span, processes, span_dict):
-    tags = span.get("tags", {})
-    pid = span.get("processID", "")
-    process = processes.get(pid, {}) if pid else {}
-    service_name = (
-        process.get("serviceName") or
-        (process["host.name"].split("-")[0] if "host.name" in process and "sas-" in process["host.name"] else process.get("host.name")) or
-        tags.get("messaging.source.name") or
-        tags.get("net.host.name") or
-        tags.get("user_agent.original", "").split()[-1] if "sas-" in tags.get("user_agent.original", "") else
-        "Unknown-Service"
-    )
-    span_kind = tags.get("span.kind", "client")
-    if span_kind == "server":
-        requesting = None
-        receiving = service_name
-        for ref in span.get("references", []):
-            if ref["refType"] == "CHILD_OF" and ref["spanID"] in span_dict:
-                parent = span_dict[ref["spanID"]]
-                parent_pid = parent.get("processID", "")
-                parent_process = processes.get(parent_pid, {}) if parent_pid else {}
-                parent_service = (
-                    parent_process.get("serviceName") or
-                    (parent_process["host.name"].split("-")[0] if "host.name" in parent_process and "sas-" in parent_process["host.name"] else parent_process.get("host.name")) or
-                    parent.get("tags", {}).get("messaging.source.name") or
-                    parent.get("tags", {}).get("net.host.name") or
-                    parent.get("tags", {}).get("user_agent.original", "").split()[-1] if "sas-" in parent.get("tags", {}).get("user_agent.original", "") else
-                    "Unknown-Parent"
-                )
-                if parent_service != "Unknown-Service" and parent_service != "Unknown-Parent":
-                    requesting = parent_service
-                    break
-        if not requesting:
-            ua = tags.get("user_agent.original", "")
-            requesting = ua.split()[-1] if "sas-" in ua else tags.get("net.sock.peer.addr", "Unknown-Client")
-    elif span_kind == "consumer":
-        requesting = tags.get("messaging.source.name", service_name)
-        receiving = service_name
-    else:  # client
-        requesting = service_name
-        receiving = tags.get("server.address", tags.get("net.peer.name", "Unknown-Server"))
-    debug_log(f"Extracted service names for span {span.get('spanID', 'unknown')}: requesting={requesting}, receiving={receiving}, processID={pid}, span_kind={span_kind}, tags={tags}")
-    return requesting, receiving
-
-def extract_status_code(tags):
-    return tags.get("http.response.status_code", tags.get("http.status_code", "N/A"))
-
-def get_parent_id(span):
-    refs = span.get("references", [])
-    for ref in refs:
-        if ref["refType"] == "CHILD_OF":
-            return ref["spanID"]
-    return None
-
-def is_database_operation(span):
-    tags = span.get("tags", {})
-    return "db.statement" in tags
-
-def is_leaf_node(span_id, hierarchy):
-    return not hierarchy.get(span_id, [])
-
-def get_leaf_spans(span_id, hierarchy, span_dict, leaf_spans=None):
-    if leaf_spans is None:
-        leaf_spans = []
-    children = hierarchy.get(span_id, [])
-    if not children:
-        leaf_spans.append(span_dict[span_id])
-    else:
-        for child in children:
-            get_leaf_spans(child["spanID"], hierarchy, span_dict, leaf_spans)
-    return leaf_spans
-
-def abridge_query(query, max_length=50):
-    if len(query) <= max_length:
-        return query
-    return query[:max_length-3] + "..."
-
-def compare_spans(span1, span2, span_dict, hierarchy, processes, is_top_level=True):
-    debug_log(f"Comparing spans {span1['spanID']} and {span2['spanID']} (top_level={is_top_level})")
-    is_leaf1 = is_leaf_node(span1["spanID"], hierarchy)
-    is_leaf2 = is_leaf_node(span2["spanID"], hierarchy)
-    if is_leaf1 and is_leaf2 and is_database_operation(span1) and is_database_operation(span2):
-        debug_log(f"Leaf database spans detected, skipping operation name check")
-    elif span1["operationName"] != span2["operationName"]:
-        debug_log(f"Span operation names do not match: {span1['operationName']} vs {span2['operationName']}")
-        return False
-
-    parent_id1 = get_parent_id(span1)
-    parent_id2 = get_parent_id(span2)
-    if is_top_level and parent_id1 != parent_id2:
-        debug_log(f"Top-level span parent IDs do not match: {parent_id1} vs {parent_id2}")
-        return False
-    
-    if is_database_operation(span_dict.get(parent_id1, {})):
-        debug_log(f"Parent span is a database operation: {parent_id1}")
-        return False
-    
-    req1, rec1 = extract_service_names(span1, processes, span_dict)
-    req2, rec2 = extract_service_names(span2, processes, span_dict)
-    if req1 != req2 or rec1 != rec2:
-        debug_log(f"Service names do not match: {req1}/{rec1} vs {req2}/{rec2}")
-        return False
-    
-    if abs(span1["startTime"] - span2["startTime"]) > 500_000:
-        debug_log(f"Start times do not match within tolerance: {span1['startTime']} vs {span2['startTime']}")
-        return False
-    
-    duration_diff = abs(span1["duration"] - span2["duration"])
-    max_duration = max(span1["duration"], span2["duration"])
-    if duration_diff > max(100_000, 0.2 * max_duration):
-        debug_log(f"Durations do not match within tolerance: {span1['duration']} vs {span2['duration']}")
-        return False
-    
-    children1 = sorted(hierarchy.get(span1["spanID"], []), key=lambda x: (x["operationName"], x["startTime"]))
-    children2 = sorted(hierarchy.get(span2["spanID"], []), key=lambda x: (x["operationName"], x["startTime"]))
-    debug_log(f"Children of {span1['spanID']}: {[(c['spanID'], get_parent_id(c)) for c in children1]}")
-    debug_log(f"Children of {span2['spanID']}: {[(c['spanID'], get_parent_id(c)) for c in children2]}")
-    if len(children1) != len(children2):
-        debug_log(f"Number of children do not match: {len(children1)} vs {len(children2)}")
-        return False
-    
-    for c1, c2 in zip(children1, children2):
-        c1_parent = get_parent_id(c1)
-        c2_parent = get_parent_id(c2)
-        if c1_parent != span1["spanID"] or c2_parent != span2["spanID"]:
-            debug_log(f"Child span parentage inconsistent with top-level span: {c1['spanID']} parent {c1_parent} != {span1['spanID']}, {c2['spanID']} parent {c2_parent} != {span2['spanID']}")
-            return False
-        if not compare_spans(c1, c2, span_dict, hierarchy, processes, is_top_level=False):
-            return False
-    return True
-
-def cluster_duplicates(group_spans, span_dict, hierarchy, processes):
-    clusters = []
-    used = set()
-    group_spans.sort(key=lambda x: x["startTime"])
-    debug_log(f"Clustering spans for {group_spans[0]['operationName']} with {len(group_spans)} spans: {[s['spanID'] for s in group_spans]}")
-    
-    for i, span1 in enumerate(group_spans):
-        if span1["spanID"] in used:
-            continue
-        cluster = [span1]
-        used.add(span1["spanID"])
-        for j in range(i + 1, len(group_spans)):
-            span2 = group_spans[j]
-            if span2["spanID"] not in used and abs(span1["startTime"] - span2["startTime"]) <= 500_000:
-                debug_log(f"Attempting to compare {span1['spanID']} with {span2['spanID']}")
-                if compare_spans(span1, span2, span_dict, hierarchy, processes):
-                    cluster.append(span2)
-                    used.add(span2["spanID"])
-        if len(cluster) > 1:
-            clusters.append(cluster)
-            debug_log(f"Formed initial cluster: {[s['spanID'] for s in cluster]}")
-    
-    merged_clusters = []
-    while clusters:
-        current_cluster = clusters.pop(0)
-        i = 0
-        while i < len(clusters):
-            other_cluster = clusters[i]
-            should_merge = False
-            for span1 in current_cluster:
-                for span2 in other_cluster:
-                    if abs(span1["startTime"] - span2["startTime"]) <= 500_000:
-                        should_merge = True
-                        break
-                if should_merge:
-                    break
-            if should_merge:
-                current_cluster.extend(clusters.pop(i))
-            else:
-                i += 1
-        merged_clusters.append(current_cluster)
-        debug_log(f"Merged cluster: {[s['spanID'] for s in current_cluster]}")
-    
-    debug_log(f"Clustered {len(merged_clusters)} groups for {group_spans[0]['operationName']}")
-    return merged_clusters
-
-def find_duplicate_spans(file_path):
-    with open(file_path, "r") as file:
-        parser = ijson.parse(file)
-        spans = []
-        processes = {}
-        trace_id = None
-        current_span = None
-        current_span_tags = []
-        current_references = []
-
-        debug_log(f"Starting parsing")
-
-        for prefix, event, value in parser:
-            parts = prefix.split(".")
-            if prefix == "data.item.traceID" and event == "string":
-                trace_id = value
-                debug_log(f"Trace ID: {trace_id}")
-
-            elif prefix == "data.item.spans.item" and event == "start_map":
-                current_span = {"tags": {}, "references": []}
-                current_span_tags = []
-                current_references = []
-
-            elif prefix == "data.item.spans.item" and event == "end_map":
-                if current_span:
-                    current_span["tags"] = {tag["key"]: tag["value"] for tag in current_span_tags if "key" in tag and "value" in tag}
-                    current_span["references"] = current_references
-                    if "spanID" in current_span and "startTime" in current_span and "duration" in current_span:
-                        spans.append(current_span)
-                        debug_log(f"Span added: {current_span['spanID']}")
-                    current_span = None
-                    current_span_tags = []
-                    current_references = []
-
-            elif prefix == "data.item.spans.item.tags.item" and event == "start_map":
-                current_span_tags.append({})
-            elif prefix.endswith(".key") and event in ("string", "number") and current_span_tags:
-                current_span_tags[-1]["key"] = str(value).replace("http.method", "http.request.method")
-            elif prefix.endswith(".value") and event in ("string", "number") and current_span_tags:
-                current_span_tags[-1]["value"] = str(value)
-
-            elif prefix == "data.item.spans.item.references.item" and event == "start_map":
-                current_references.append({})
-            elif prefix.endswith(".refType") and current_references:
-                current_references[-1]["refType"] = value
-            elif prefix.endswith(".spanID") and event == "string":
-                if current_references:
-                    current_references[-1]["spanID"] = value
-                elif prefix == "data.item.spans.item.spanID":
-                    current_span["spanID"] = value
-
-            elif current_span and event in ("string", "number"):
-                if prefix == "data.item.spans.item.operationName":
-                    current_span["operationName"] = value
-                elif prefix == "data.item.spans.item.startTime":
-                    current_span["startTime"] = int(value)
-                elif prefix == "data.item.spans.item.duration":
-                    current_span["duration"] = int(value)
-                elif prefix == "data.item.spans.item.processID":
-                    current_span["processID"] = value
-
-            elif prefix.startswith("data.item.processes"):
-                if len(parts) >= 4:
-                    pid = parts[3]
-                    if pid.startswith("p") and pid[1:].isdigit():
-                        if event == "string" and prefix.endswith(".serviceName"):
-                            if pid not in processes:
-                                processes[pid] = {}
-                            processes[pid]["serviceName"] = value
-
-        if not spans or not trace_id:
-            debug_log(f"Spans: {len(spans)}, Trace ID: {trace_id}")
-            print("No valid spans or trace ID found.")
-            sys.exit(1)
-
-        span_dict, hierarchy, roots = build_span_hierarchy(spans)
-        span_groups = defaultdict(list)
-        depth_map = {}
-        for span in span_dict.values():
-            depth = get_hierarchy_depth(span_dict, hierarchy, span["spanID"])
-            depth_map[span["spanID"]] = depth
-            span_groups[(span["operationName"], depth)].append(span)
-            debug_log(f"Span {span['spanID']} grouped with depth: {depth}, operation: {span['operationName']}")
-
-        duplicate_groups = {}
-        for key, group in span_groups.items():
-            if len(group) > 1 and key[1] >= 1:
-                duplicate_groups[key] = cluster_duplicates(group, span_dict, hierarchy, processes)
-                if duplicate_groups[key]:
-                    debug_log(f"Duplicate groups for {key}: {[(span['spanID'], span['operationName']) for cluster in duplicate_groups[key] for span in cluster]}")
-
-        debug_log(f"Final processes dict: {processes}")
-        debug_log(f"Depth map: {depth_map}")
-        return duplicate_groups, trace_id, processes, span_dict, hierarchy
-
-def summarize_duplicates(duplicate_groups, trace_id, processes, span_dict, hierarchy):
-    debug_log(f"Starting summarize_duplicates with trace_id: {trace_id}, duplicate_groups: {len(duplicate_groups)}")
-    lines = [f"\nPotential Duplicate HTTP Span Groups in Trace ID: {trace_id}\n"]
-    if not duplicate_groups:
-        lines.append("No duplicate HTTP span groups found.")
-        debug_log("No duplicate groups found")
-        return "\n".join(lines)
-
-    try:
-        for (op_name, depth), clusters in sorted(duplicate_groups.items()):
-            debug_log(f"Processing operation {op_name} at depth {depth} with {len(clusters)} clusters")
-            if len(clusters) == 0:
-                debug_log(f"Skipping empty cluster for {op_name} at depth {depth}")
-                continue
-            parent_span_id = get_parent_id(clusters[0][0]) or "Unknown"
-            parent_span = span_dict.get(parent_span_id, {})
-            debug_log(f"Parent span ID: {parent_span_id}, span data: {parent_span}")
-            parent_requesting, parent_receiving = extract_service_names(parent_span, processes, span_dict)
-            parent_request = parent_span.get("operationName", "Unknown")
-            
-            lines.append(f"Parent Service Name: {parent_requesting}")
-            lines.append(f"Parent HTTP Request: {parent_request}")
-            lines.append(f"Parent Span ID: {parent_span_id}")
-            lines.append(f"Operation Name: {op_name} with Hierarchy Depth: {depth}")
-            lines.append(f"Duplicate Cluster Count: {len(clusters)}\n")
-            
-            for i, cluster in enumerate(clusters[:10], 1):
-                debug_log(f"Processing cluster {i} with first span: {cluster[0]['spanID']}")
-                requesting, receiving = extract_service_names(cluster[0], processes, span_dict)
-                debug_log(f"Cluster {i} assigned: requesting={requesting}, receiving={receiving}")
-                lines.append(f"Cluster {i} -- Requesting Service: {requesting}, Receiving Service: {receiving} (Size: {len(cluster)}):")
-                sorted_cluster = sorted(cluster, key=lambda x: x["startTime"])
-                for j, span in enumerate(sorted_cluster[:5], 1):
-                    start_time = parse_time(span["startTime"])
-                    duration = span["duration"]
-                    status_code = extract_status_code(span["tags"])
-                    lines.extend([
-                        f"  Span {j} - ID: {span['spanID']}, Start Time: {start_time}, Duration: {duration} microseconds, HTTP Status Code: {status_code}"
-                    ])
-                if len(cluster) > 5:
-                    lines.append(f"    ...and {len(cluster) - 5} more spans")
-                
-                leaf_spans = get_leaf_spans(sorted_cluster[0]["spanID"], hierarchy, span_dict)
-                if leaf_spans:
-                    leaf = leaf_spans[0]
-                    if is_database_operation(leaf):
-                        query = leaf["tags"].get("db.statement", "Unknown Query")
-                        lines.append(f"  Last Generation DB Query: {abridge_query(query)}")
-                    else:
-                        lines.append(f"  Last Generation HTTP Request: {leaf['operationName']}")
-                else:
-                    lines.append("  Last Generation: None")
-                lines.append("")
-            
-            lines.append("-" * 40)
-    except Exception as e:
-        debug_log(f"Exception in summarize_duplicates: {str(e)}")
-        raise
-
-    debug_log("Finished summarize_duplicates")
-    return "\n".join(lines)
-
-if __name__ == "__main__":
-    try:
-        debug_log("Starting main execution")
-        duplicate_groups, trace_id, processes, span_dict, hierarchy = find_duplicate_spans(trace_file)
-        debug_log("Calling summarize_duplicates")
-        result = summarize_duplicates(duplicate_groups, trace_id, processes, span_dict, hierarchy)
-        print(result)
-        debug_log("Main execution completed")
-    except Exception as e:
-        debug_log(f"Error in main: {str(e)}")
-        print(f"Error: {e}", file=sys.stderr)
-        sys.exit(1)
-    finally:
-        debug_file.close()
+# -*- coding: utf-8 -*-
+try:
+    import ijson.backends.yajl2_c as ijson
+except ImportError:
+    try:
+        import ijson.backends.yajl2_cffi as ijson
+    except ImportError:
+        import ijson
+import numpy as np
+import orjson
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+import io
+from operator import itemgetter
+import os
+import sys
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+if len(sys.argv) < 2:
+    print("Usage: python detect_duplicates.py <path_to_trace_file>")
+    sys.exit(1)
+
+trace_file = sys.argv[1]
+STREAMING_THRESHOLD = 500 * 1024 * 1024  # Above this size, stream with ijson instead of loading in one piece
+
+# Debug logging is off by default - the hot loops call debug_log per event,
+# per span and per comparison, so the disabled variant must be a plain no-op
+# and the call sites inside those loops are additionally guarded with
+# `if DEBUG:` to skip the f-string formatting. Enable with SPANS_DEBUG=1.
+DEBUG = os.environ.get("SPANS_DEBUG") == "1"
+if DEBUG:
+    try:
+        # 1MB buffer - debug runs write a line per span/comparison, and
+        # flushing each would be a syscall per message. Closed at exit.
+        debug_file = open("debug_log.txt", "w", encoding='utf-8', buffering=1 << 20)
+    except IOError as e:
+        print(f"Failed to open debug log file: {e}")
+        sys.exit(1)
+
+    def debug_log(message):
+        print(f"[DEBUG] {message}", file=debug_file)
+else:
+    debug_file = None
+
+    def debug_log(message):
+        pass
+
+def parse_time(timestamp):
+    return datetime.fromtimestamp(timestamp / 1_000_000)
+
+@lru_cache(maxsize=4096)
+def extract_path_from_url(url):
+    """Path component of a URL, memoized - traces repeat the same handful of
+    URLs across thousands of spans.
+
+    Hand-rolled scan instead of urlparse: trace URLs are plain
+    scheme://host[:port]/path[?query] strings, and urlparse builds a full
+    ParseResult with quoting/encoding handling just to read one field."""
+    i = url.find("://")
+    if i < 0:
+        # No netloc (e.g. a bare "/api/foo" path): everything up to any
+        # query/fragment is the path, matching urlparse's behaviour.
+        path = url
+    else:
+        j = url.find("/", i + 3)
+        # A "/" only counts as the path start if it comes before any
+        # query/fragment; otherwise the URL has no path component.
+        for sep in ("?", "#"):
+            k = url.find(sep, i + 3)
+            if 0 <= k < (j if j >= 0 else len(url)):
+                return ""
+        if j < 0:
+            return ""
+        path = url[j:]
+    for sep in ("?", "#"):
+        j = path.find(sep)
+        if j >= 0:
+            path = path[:j]
+    return path
+
+# Tag keys that can carry the HTTP path, in resolution order; most spans have
+# exactly one, so the scan usually stops at the first hit.
+_PATH_KEYS = ("url.full", "http.target", "url.path", "http.route")
+
+def build_span_hierarchy(span_dict):
+    """Shape operation names and link parent/child structure over span_dict,
+    which the parsers fill directly (insertion order is parse order; a
+    duplicated spanID keeps the last occurrence, as it always has)."""
+    hierarchy = defaultdict(list)
+    roots = []
+    for span in span_dict.values():
+        tags = span.get("tags", {})
+        if "operationName" not in span or span["operationName"] in ["GET", "POST", "PUT", "DELETE"]:
+            method = tags.get("http.request.method") or tags.get("http.method") or "UNKNOWN"
+            path = None
+            for key in _PATH_KEYS:
+                path = tags.get(key)
+                if path:
+                    break
+            if path is None and "http.url" in tags:
+                path = extract_path_from_url(tags["http.url"])
+            if path is None:
+                path = "/*" if "http.method" in tags or "http.request.method" in tags else "Unknown Operation"
+            span["operationName"] = f"{method} {path}" if path else span.get("operationName", "Unknown Operation")
+        # Interned names share one object per distinct operation, so the
+        # equality checks in compare_spans hit the pointer fast path.
+        span["operationName"] = sys.intern(span["operationName"])
+        span["_isDB"] = "db.statement" in tags
+        if DEBUG:
+            debug_log(f"Built span {span['spanID']} with operationName: {span['operationName']}")
+
+    for span in span_dict.values():
+        parent_id = None
+        first_child_of = None
+        for ref in span.get("references", []):
+            if ref["refType"] != "CHILD_OF":
+                continue
+            # get_parent_id historically reported the first CHILD_OF ref even
+            # when that parent isn't in the trace; keep both notions.
+            if first_child_of is None:
+                first_child_of = ref["spanID"]
+            if ref["spanID"] in span_dict:
+                parent_id = ref["spanID"]
+                hierarchy[parent_id].append(span)
+                break
+        span["_parentID"] = first_child_of
+        if not parent_id:
+            roots.append(span)
+
+    # compare_spans pairs children in (operationName, startTime) order; sort
+    # each parent's list once here instead of on every comparison. Stored
+    # separately because get_leaf_spans depends on the hierarchy's insertion
+    # order.
+    for pid, children in hierarchy.items():
+        span_dict[pid]["_sortedChildren"] = sorted(children, key=lambda x: (x["operationName"], x["startTime"]))
+
+    # Leaf-ness is fixed once the hierarchy is linked; compare_spans asks
+    # about leaf database spans on every pair, so answer it here once.
+    for span in span_dict.values():
+        span["_isLeafDB"] = span["_isDB"] and not hierarchy.get(span["spanID"])
+
+    return span_dict, hierarchy, roots
+
+def compute_depth_map(span_dict, hierarchy, roots):
+    """Subtree depth for every span, from one iterative post-order pass.
+
+    The old recursive helper was called with a fresh memo per span, so each
+    span re-walked its whole subtree; a shared explicit-stack walk visits
+    every span once and cannot hit the recursion limit on deep traces."""
+    depth_map = {}
+    for root in roots:
+        stack = [(root["spanID"], False)]
+        while stack:
+            span_id, children_done = stack.pop()
+            children = hierarchy.get(span_id, [])
+            if children_done or not children:
+                depth_map[span_id] = 0 if not children else 1 + max(depth_map[child["spanID"]] for child in children)
+            else:
+                stack.append((span_id, True))
+                for child in children:
+                    stack.append((child["spanID"], False))
+    return depth_map
+
+_process_service_cache = {}
+
+def process_service_name(pid, processes):
+    """serviceName (or derived host.name) for a processID, cached per pid.
+
+    The processes dict never changes after parsing, yet every
+    extract_service_names call redid the serviceName/host.name dance -
+    including the split - for the same handful of pids. May return None,
+    leaving the tag-based fallbacks to the caller's or-chain."""
+    if pid in _process_service_cache:
+        return _process_service_cache[pid]
+    process = processes.get(pid, {}) if pid else {}
+    name = (
+        process.get("serviceName") or
+        (process["host.name"].split("-")[0] if "host.name" in process and "sas-" in process["host.name"] else process.get("host.name"))
+    )
+    _process_service_cache[pid] = name
+    return name
+
+def _span_service_name(span, processes, default):
+    """One resolution chain for a span's own service name, shared between the
+    span itself and the parent lookup in the server branch - the two copies
+    had to be kept in sync by hand (only the final fallback differs)."""
+    tags = span.get("tags", {})
+    return (
+        process_service_name(span.get("processID", ""), processes) or
+        tags.get("messaging.source.name") or
+        tags.get("net.host.name") or
+        tags.get("user_agent.original", "").split()[-1] if "sas-" in tags.get("user_agent.original", "") else
+        default
+    )
+
+def extract_service_names(span, processes, span_dict):
+    tags = span.get("tags", {})
+    pid = span.get("processID", "")
+    service_name = _span_service_name(span, processes, "Unknown-Service")
+    span_kind = tags.get("span.kind", "client")
+    if span_kind == "server":
+        requesting = None
+        receiving = service_name
+        for ref in span.get("references", []):
+            if ref["refType"] == "CHILD_OF" and ref["spanID"] in span_dict:
+                parent = span_dict[ref["spanID"]]
+                parent_service = _span_service_name(parent, processes, "Unknown-Parent")
+                if parent_service != "Unknown-Service" and parent_service != "Unknown-Parent":
+                    requesting = parent_service
+                    break
+        if not requesting:
+            ua = tags.get("user_agent.original", "")
+            requesting = ua.split()[-1] if "sas-" in ua else tags.get("net.sock.peer.addr", "Unknown-Client")
+    elif span_kind == "consumer":
+        requesting = tags.get("messaging.source.name", service_name)
+        receiving = service_name
+    else:  # client
+        requesting = service_name
+        receiving = tags.get("server.address", tags.get("net.peer.name", "Unknown-Server"))
+    if DEBUG:
+        debug_log(f"Extracted service names for span {span.get('spanID', 'unknown')}: requesting={requesting}, receiving={receiving}, processID={pid}, span_kind={span_kind}, tags={tags}")
+    return requesting, receiving
+
+service_cache = {}
+
+def get_service_names(span, processes, span_dict):
+    """Memoized extract_service_names - the pair is a pure function of the
+    trace, and compare_spans re-asks for the same spans on every descent.
+
+    summarize_duplicates passes {} for a missing parent (root clusters or a
+    dangling CHILD_OF ref); there's nothing to key on then, so resolve
+    uncached."""
+    sid = span.get("spanID")
+    if sid is None:
+        return extract_service_names(span, processes, span_dict)
+    cached = service_cache.get(sid)
+    if cached is None:
+        cached = extract_service_names(span, processes, span_dict)
+        service_cache[sid] = cached
+    return cached
+
+def extract_status_code(tags):
+    return tags.get("http.response.status_code", tags.get("http.status_code", "N/A"))
+
+def get_parent_id(span):
+    return span.get("_parentID")
+
+def is_database_operation(span):
+    return span.get("_isDB", False)
+
+def get_leaf_spans(span_id, hierarchy, span_dict, leaf_spans=None):
+    if leaf_spans is None:
+        leaf_spans = []
+    children = hierarchy.get(span_id, [])
+    if not children:
+        leaf_spans.append(span_dict[span_id])
+    else:
+        for child in children:
+            get_leaf_spans(child["spanID"], hierarchy, span_dict, leaf_spans)
+    return leaf_spans
+
+def abridge_query(query, max_length=50):
+    if len(query) <= max_length:
+        return query
+    return query[:max_length-3] + "..."
+
+def compare_spans(span1, span2, span_dict, hierarchy, processes, is_top_level=True):
+    if DEBUG:
+        debug_log(f"Comparing spans {span1['spanID']} and {span2['spanID']} (top_level={is_top_level})")
+    # Matching signatures are necessary for a match: they cover services,
+    # child counts and child signatures, plus the operation name for inner
+    # spans - leaf names are deliberately left out of the hash because the
+    # leaf-DB waiver below means accepted leaf pairs need not agree on how
+    # the name was derived. Unequal hashes therefore end the comparison -
+    # and the whole subtree walk under it - immediately. They are not
+    # sufficient: leaf names and the time tolerances below aren't hashed,
+    # so equal signatures still fall through to the full checks.
+    if compute_structural_signature(span1, span_dict, hierarchy, processes) != \
+            compute_structural_signature(span2, span_dict, hierarchy, processes):
+        return False
+    if span1.get("_isLeafDB") and span2.get("_isLeafDB"):
+        if DEBUG:
+            debug_log(f"Leaf database spans detected, skipping operation name check")
+    elif span1["operationName"] != span2["operationName"]:
+        if DEBUG:
+            debug_log(f"Span operation names do not match: {span1['operationName']} vs {span2['operationName']}")
+        return False
+
+    parent_id1 = get_parent_id(span1)
+    parent_id2 = get_parent_id(span2)
+    if is_top_level and parent_id1 != parent_id2:
+        if DEBUG:
+            debug_log(f"Top-level span parent IDs do not match: {parent_id1} vs {parent_id2}")
+        return False
+    
+    if is_database_operation(span_dict.get(parent_id1, {})):
+        if DEBUG:
+            debug_log(f"Parent span is a database operation: {parent_id1}")
+        return False
+    
+    # Cheap integer/structure checks before service-name resolution: most
+    # mismatching pairs differ in child count or timing, and every check here
+    # is conjunctive, so rejecting on the cheap ones first changes nothing
+    # but the cost.
+    children1 = span1.get("_sortedChildren", [])
+    children2 = span2.get("_sortedChildren", [])
+    if DEBUG:
+        debug_log(f"Children of {span1['spanID']}: {[(c['spanID'], get_parent_id(c)) for c in children1]}")
+        debug_log(f"Children of {span2['spanID']}: {[(c['spanID'], get_parent_id(c)) for c in children2]}")
+    if len(children1) != len(children2):
+        if DEBUG:
+            debug_log(f"Number of children do not match: {len(children1)} vs {len(children2)}")
+        return False
+
+    if abs(span1["startTime"] - span2["startTime"]) > 500_000:
+        if DEBUG:
+            debug_log(f"Start times do not match within tolerance: {span1['startTime']} vs {span2['startTime']}")
+        return False
+    
+    duration_diff = abs(span1["duration"] - span2["duration"])
+    max_duration = max(span1["duration"], span2["duration"])
+    if duration_diff > max(100_000, 0.2 * max_duration):
+        if DEBUG:
+            debug_log(f"Durations do not match within tolerance: {span1['duration']} vs {span2['duration']}")
+        return False
+
+    req1, rec1 = get_service_names(span1, processes, span_dict)
+    req2, rec2 = get_service_names(span2, processes, span_dict)
+    if req1 != req2 or rec1 != rec2:
+        if DEBUG:
+            debug_log(f"Service names do not match: {req1}/{rec1} vs {req2}/{rec2}")
+        return False
+
+    for c1, c2 in zip(children1, children2):
+        c1_parent = get_parent_id(c1)
+        c2_parent = get_parent_id(c2)
+        if c1_parent != span1["spanID"] or c2_parent != span2["spanID"]:
+            if DEBUG:
+                debug_log(f"Child span parentage inconsistent with top-level span: {c1['spanID']} parent {c1_parent} != {span1['spanID']}, {c2['spanID']} parent {c2_parent} != {span2['spanID']}")
+            return False
+        if not compare_spans(c1, c2, span_dict, hierarchy, processes, is_top_level=False):
+            return False
+    return True
+
+signature_cache = {}
+
+def compute_structural_signature(span, span_dict, hierarchy, processes):
+    """Bottom-up structural hash of a span's subtree, memoized by spanID.
+
+    Covers the structural facts compare_spans insists on - operation name,
+    requesting/receiving services, child count and the child signatures in
+    _sortedChildren order. Leaf spans hash one shared marker instead of
+    their operation name: compare_spans waives the name check for pairs of
+    leaf database spans, so a leaf's name is not something every accepted
+    match agrees on, and hashing it would split pairs the comparison still
+    accepts (a db.statement-tagged leaf next to an untagged leaf with the
+    same name). Collapsing every leaf keeps signature equality a necessary
+    condition; leaf-versus-inner pairs still differ on child count. Two
+    spans that compare_spans would accept therefore always hash equal, so
+    unequal hashes let clustering skip the recursive comparison; equal
+    hashes still go through compare_spans for the name/parent/time checks
+    the hash leaves out."""
+    cached = signature_cache.get(span["spanID"])
+    if cached is not None:
+        return cached
+    stack = [(span, False)]
+    while stack:
+        s, children_done = stack.pop()
+        sid = s["spanID"]
+        if sid in signature_cache:
+            continue
+        children = s.get("_sortedChildren", [])
+        if children_done or not children:
+            req, rec = get_service_names(s, processes, span_dict)
+            if not children:
+                op = "__LEAF__"
+            else:
+                op = s["operationName"]
+            signature_cache[sid] = hash((op, req, rec, len(children),
+                                         tuple(signature_cache[c["spanID"]] for c in children)))
+        else:
+            stack.append((s, True))
+            for child in children:
+                stack.append((child, False))
+    return signature_cache[span["spanID"]]
+
+def cluster_duplicates(group_spans, span_dict, hierarchy, processes):
+    clusters = []
+    used = set()
+    group_spans.sort(key=itemgetter("startTime"))
+    # Structure-of-arrays view of the sorted start times: the 500ms candidate
+    # window becomes a searchsorted cutoff instead of a per-candidate abs()
+    # check over the whole tail of the group.
+    start_times = np.fromiter((s["startTime"] for s in group_spans), dtype=np.int64, count=len(group_spans))
+    durations = np.fromiter((s["duration"] for s in group_spans), dtype=np.int64, count=len(group_spans))
+    if DEBUG:
+        debug_log(f"Clustering spans for {group_spans[0]['operationName']} with {len(group_spans)} spans: {[s['spanID'] for s in group_spans]}")
+
+    # Fingerprint census: a span whose structural signature appears once in
+    # the group cannot match anything, so its whole window scan can be
+    # skipped. This leans on the same invariant as the compare_spans gate -
+    # signature equality is necessary for a match, which holds because leaf
+    # operation names are collapsed out of the hash rather than hashed
+    # inconsistently with the leaf-DB waiver. The signatures are memoized,
+    # so the inner-loop checks below reuse these computations.
+    sig_counts = {}
+    for s in group_spans:
+        sig = compute_structural_signature(s, span_dict, hierarchy, processes)
+        sig_counts[sig] = sig_counts.get(sig, 0) + 1
+
+    for i, span1 in enumerate(group_spans):
+        if span1["spanID"] in used:
+            continue
+        sig1 = compute_structural_signature(span1, span_dict, hierarchy, processes)
+        if sig_counts[sig1] < 2:
+            continue
+        cluster = [span1]
+        used.add(span1["spanID"])
+        hi = int(np.searchsorted(start_times, span1["startTime"] + 500_000, side="right"))
+        if hi <= i + 1:
+            continue
+        # Vectorized version of compare_spans' duration tolerance over the
+        # whole candidate window: candidates failing it here would fail the
+        # same check inside compare_spans, so this only skips guaranteed
+        # rejections.
+        window_durations = durations[i + 1:hi]
+        max_durations = np.maximum(window_durations, span1["duration"])
+        duration_ok = np.abs(window_durations - span1["duration"]) <= np.maximum(100_000, 0.2 * max_durations)
+        for j in range(i + 1, hi):
+            if not duration_ok[j - i - 1]:
+                continue
+            span2 = group_spans[j]
+            if span2["spanID"] not in used:
+                if compute_structural_signature(span2, span_dict, hierarchy, processes) != sig1:
+                    if DEBUG:
+                        debug_log(f"Skipping comparison of {span1['spanID']} with {span2['spanID']}: structural signatures differ")
+                    continue
+                if DEBUG:
+                    debug_log(f"Attempting to compare {span1['spanID']} with {span2['spanID']}")
+                if compare_spans(span1, span2, span_dict, hierarchy, processes):
+                    cluster.append(span2)
+                    used.add(span2["spanID"])
+        if len(cluster) > 1:
+            clusters.append(cluster)
+            if DEBUG:
+                debug_log(f"Formed initial cluster: {[s['spanID'] for s in cluster]}")
+    
+    # Merge clusters whose spans come within 500ms of each other. Every
+    # cluster spans at most 500ms by construction (its members were pulled
+    # from the seed's searchsorted window), so "some span pair within 500ms"
+    # is equivalent to the clusters' [min,max] start ranges coming within
+    # 500ms - a one-dimensional interval chain. Sweeping the ranges in start
+    # order finds the full transitive merge in O(c log c), replacing the old
+    # pop-and-rescan pass that compared every span pair across every cluster
+    # pair (and could miss merges unlocked by an earlier absorption).
+    merged_clusters = []
+    if clusters:
+        bounds = sorted(
+            (c[0]["startTime"], c[-1]["startTime"], idx)
+            for idx, c in enumerate(clusters)
+        )
+        components = []
+        current, cur_max = [bounds[0][2]], bounds[0][1]
+        for mn, mx, idx in bounds[1:]:
+            if mn <= cur_max + 500_000:
+                current.append(idx)
+                cur_max = max(cur_max, mx)
+            else:
+                components.append(current)
+                current, cur_max = [idx], mx
+        components.append(current)
+        # Emit merged clusters in the order the old loop would have: by the
+        # first-formed member cluster, concatenating members in formation
+        # order.
+        components.sort(key=min)
+        for comp in components:
+            comp.sort()
+            current_cluster = []
+            for idx in comp:
+                current_cluster.extend(clusters[idx])
+            merged_clusters.append(current_cluster)
+            if DEBUG:
+                debug_log(f"Merged cluster: {[s['spanID'] for s in current_cluster]}")
+    
+    if DEBUG:
+        debug_log(f"Clustered {len(merged_clusters)} groups for {group_spans[0]['operationName']}")
+    return merged_clusters
+
+def shape_span(raw_span):
+    """Shape one raw span dict into the internal layout, or None if the span
+    lacks the identifying fields. Only string/number tag values survive."""
+    if "spanID" not in raw_span or "startTime" not in raw_span or "duration" not in raw_span:
+        return None
+    tags = {}
+    for tag in raw_span.get("tags", []):
+        key = tag.get("key")
+        value = tag.get("value")
+        if key is None or value is None or isinstance(value, (bool, dict, list)):
+            continue
+        tags[str(key).replace("http.method", "http.request.method")] = str(value)
+    references = []
+    for ref in raw_span.get("references", []):
+        new_ref = {}
+        if "refType" in ref:
+            new_ref["refType"] = ref["refType"]
+        if isinstance(ref.get("spanID"), str):
+            new_ref["spanID"] = ref["spanID"]
+        references.append(new_ref)
+    span = {
+        "tags": tags,
+        "references": references,
+        "spanID": raw_span["spanID"],
+        "startTime": int(raw_span["startTime"]),
+        "duration": int(raw_span["duration"]),
+    }
+    if "operationName" in raw_span:
+        span["operationName"] = raw_span["operationName"]
+    if "processID" in raw_span:
+        span["processID"] = raw_span["processID"]
+    return span
+
+def parse_trace_bulk(file_path):
+    """Load the whole trace with orjson and walk the dict tree once - the
+    per-event prefix matching of the streaming parser is far slower when the
+    file fits in memory."""
+    with open(file_path, "rb") as file:
+        doc = orjson.loads(file.read())
+    span_dict = {}
+    processes = {}
+    trace_id = None
+    debug_log(f"Starting bulk parsing")
+    for trace in doc.get("data", []):
+        if isinstance(trace.get("traceID"), str):
+            trace_id = trace["traceID"]
+            debug_log(f"Trace ID: {trace_id}")
+        for pid, process in trace.get("processes", {}).items():
+            if pid.startswith("p") and pid[1:].isdigit() and "serviceName" in process:
+                if pid not in processes:
+                    processes[pid] = {}
+                processes[pid]["serviceName"] = process["serviceName"]
+        for raw_span in trace.get("spans", []):
+            span = shape_span(raw_span)
+            if span is None:
+                continue
+            span_dict[span["spanID"]] = span
+            if DEBUG:
+                debug_log(f"Span added: {span['spanID']}")
+    return span_dict, processes, trace_id
+
+def parse_trace_streaming(file_path):
+    """Streaming ijson parse for files too large to load in one piece.
+
+    ijson.items builds each span dict in the C backend and hands it to the
+    same shape_span the bulk path uses; the old hand-written event loop did
+    a Python-level prefix comparison per token. Binary mode with a large
+    buffer keeps the backend fed without extra read syscalls."""
+    span_dict = {}
+    processes = {}
+    trace_id = None
+    debug_log(f"Starting parsing")
+    with open(file_path, "rb", buffering=1 << 20) as file:
+        for raw_span in ijson.items(file, "data.item.spans.item", use_float=True):
+            span = shape_span(raw_span)
+            if span is not None:
+                span_dict[span["spanID"]] = span
+                if DEBUG:
+                    debug_log(f"Span added: {span['spanID']}")
+        file.seek(0)
+        for value in ijson.items(file, "data.item.traceID", use_float=True):
+            if isinstance(value, str):
+                trace_id = value
+                debug_log(f"Trace ID: {trace_id}")
+        file.seek(0)
+        for pid, process in ijson.kvitems(file, "data.item.processes", use_float=True):
+            if pid.startswith("p") and pid[1:].isdigit() and "serviceName" in process:
+                if pid not in processes:
+                    processes[pid] = {}
+                processes[pid]["serviceName"] = process["serviceName"]
+
+    return span_dict, processes, trace_id
+
+def find_duplicate_spans(file_path):
+    if os.path.getsize(file_path) > STREAMING_THRESHOLD:
+        span_dict, processes, trace_id = parse_trace_streaming(file_path)
+    else:
+        span_dict, processes, trace_id = parse_trace_bulk(file_path)
+
+    if not span_dict or not trace_id:
+        debug_log(f"Spans: {len(span_dict)}, Trace ID: {trace_id}")
+        print("No valid spans or trace ID found.")
+        sys.exit(1)
+
+    span_dict, hierarchy, roots = build_span_hierarchy(span_dict)
+    span_groups = defaultdict(list)
+    depth_map = compute_depth_map(span_dict, hierarchy, roots)
+    # Group on everything compare_spans demands equal at the top level -
+    # operation, depth, parent and the service pair - so cluster_duplicates
+    # never scans candidate pairs that are guaranteed to be rejected.
+    for span in span_dict.values():
+        depth = depth_map[span["spanID"]]
+        req, rec = get_service_names(span, processes, span_dict)
+        span_groups[(span["operationName"], depth, span["_parentID"], req, rec)].append(span)
+        if DEBUG:
+            debug_log(f"Span {span['spanID']} grouped with depth: {depth}, operation: {span['operationName']}")
+
+    # Downstream keys stay (operation, depth): clusters from the refined
+    # subgroups are folded back together and ordered by first start time,
+    # matching the seed order the single coarse group used to produce.
+    # Groups only share read-only state, so clustering them is embarrassingly
+    # parallel; a thread pool avoids pickling the linked span graph the way a
+    # process pool would, and draining futures in submission order keeps the
+    # serial loop's ordering.
+    duplicate_groups = {}
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        pending = [
+            (key, executor.submit(cluster_duplicates, group, span_dict, hierarchy, processes))
+            for key, group in span_groups.items()
+            if len(group) > 1 and key[1] >= 1
+        ]
+        for key, future in pending:
+            clusters = future.result()
+            if clusters:
+                duplicate_groups.setdefault((key[0], key[1]), []).extend(clusters)
+                if DEBUG:
+                    debug_log(f"Duplicate groups for {key}: {[(span['spanID'], span['operationName']) for cluster in clusters for span in cluster]}")
+    for clusters in duplicate_groups.values():
+        clusters.sort(key=lambda c: c[0]["startTime"])
+
+    debug_log(f"Final processes dict: {processes}")
+    debug_log(f"Depth map: {depth_map}")
+    return duplicate_groups, trace_id, processes, span_dict, hierarchy
+
+def summarize_duplicates(duplicate_groups, trace_id, processes, span_dict, hierarchy):
+    """Write the duplicate report straight to stdout, one line at a time.
+
+    The report used to be accumulated into a list and joined into one giant
+    string for a single print(); streaming through a block-buffered wrapper
+    over sys.stdout.buffer keeps peak memory flat on large traces. The
+    wrapper is detached (not closed) at the end so stdout stays usable."""
+    debug_log(f"Starting summarize_duplicates with trace_id: {trace_id}, duplicate_groups: {len(duplicate_groups)}")
+    out = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", write_through=False)
+    try:
+        emit(out, f"\nPotential Duplicate HTTP Span Groups in Trace ID: {trace_id}\n")
+        if not duplicate_groups:
+            emit(out, "No duplicate HTTP span groups found.")
+            debug_log("No duplicate groups found")
+            return
+        for (op_name, depth), clusters in sorted(duplicate_groups.items()):
+            if DEBUG:
+                debug_log(f"Processing operation {op_name} at depth {depth} with {len(clusters)} clusters")
+            if len(clusters) == 0:
+                if DEBUG:
+                    debug_log(f"Skipping empty cluster for {op_name} at depth {depth}")
+                continue
+            parent_span_id = get_parent_id(clusters[0][0]) or "Unknown"
+            parent_span = span_dict.get(parent_span_id, {})
+            if DEBUG:
+                debug_log(f"Parent span ID: {parent_span_id}, span data: {parent_span}")
+            parent_requesting, parent_receiving = get_service_names(parent_span, processes, span_dict)
+            parent_request = parent_span.get("operationName", "Unknown")
+            
+            emit(out, f"Parent Service Name: {parent_requesting}")
+            emit(out, f"Parent HTTP Request: {parent_request}")
+            emit(out, f"Parent Span ID: {parent_span_id}")
+            emit(out, f"Operation Name: {op_name} with Hierarchy Depth: {depth}")
+            emit(out, f"Duplicate Cluster Count: {len(clusters)}\n")
+            
+            for i, cluster in enumerate(clusters[:10], 1):
+                if DEBUG:
+                    debug_log(f"Processing cluster {i} with first span: {cluster[0]['spanID']}")
+                requesting, receiving = get_service_names(cluster[0], processes, span_dict)
+                if DEBUG:
+                    debug_log(f"Cluster {i} assigned: requesting={requesting}, receiving={receiving}")
+                emit(out, f"Cluster {i} -- Requesting Service: {requesting}, Receiving Service: {receiving} (Size: {len(cluster)}):")
+                sorted_cluster = sorted(cluster, key=itemgetter("startTime"))
+                for j, span in enumerate(sorted_cluster[:5], 1):
+                    start_time = parse_time(span["startTime"])
+                    duration = span["duration"]
+                    status_code = extract_status_code(span["tags"])
+                    emit(out, f"  Span {j} - ID: {span['spanID']}, Start Time: {start_time}, Duration: {duration} microseconds, HTTP Status Code: {status_code}")
+                if len(cluster) > 5:
+                    emit(out, f"    ...and {len(cluster) - 5} more spans")
+                
+                leaf_spans = get_leaf_spans(sorted_cluster[0]["spanID"], hierarchy, span_dict)
+                if leaf_spans:
+                    leaf = leaf_spans[0]
+                    if is_database_operation(leaf):
+                        query = leaf["tags"].get("db.statement", "Unknown Query")
+                        emit(out, f"  Last Generation DB Query: {abridge_query(query)}")
+                    else:
+                        emit(out, f"  Last Generation HTTP Request: {leaf['operationName']}")
+                else:
+                    emit(out, "  Last Generation: None")
+                emit(out, "")
+            
+            emit(out, "-" * 40)
+    except Exception as e:
+        debug_log(f"Exception in summarize_duplicates: {str(e)}")
+        raise
+    finally:
+        out.flush()
+        out.detach()
+
+    debug_log("Finished summarize_duplicates")
+
+def emit(out, line):
+    out.write(line)
+    out.write("\n")
+
+if __name__ == "__main__":
+    try:
+        debug_log("Starting main execution")
+        duplicate_groups, trace_id, processes, span_dict, hierarchy = find_duplicate_spans(trace_file)
+        debug_log("Calling summarize_duplicates")
+        summarize_duplicates(duplicate_groups, trace_id, processes, span_dict, hierarchy)
+        debug_log("Main execution completed")
+    except Exception as e:
+        debug_log(f"Error in main: {str(e)}")
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if debug_file:
+            debug_file.close()